@@ -0,0 +1,104 @@
+"""
+Compares the speed of the page extractors on the pages in
+benchmarks/fixtures. For every case the extractors must return the same
+records; the number of pages and records parsed per second is reported
+for each.
+
+Usage: python benchmarks/parse_speed.py [-n PAGES] [CASE ...]
+"""
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+sys.path.append(ROOT)
+import books_scraper.scraper as SCR
+from books_scraper import html2csv
+
+SCR.log = lambda msg: None
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as fp:
+        return fp.read()
+
+
+def goodreads_book():
+    html = _fixture("goodreads_book.html")
+    url = "/book/show/6708.The_Power_of_Now"
+    return {
+        "bs4 full": lambda: SCR.parse_book_detail(html, url, False),
+        "bs4": lambda: SCR.parse_book_detail(html, url),
+        "lxml full": lambda: SCR.parse_book_detail_lxml(html, url, False),
+        "lxml": lambda: SCR.parse_book_detail_lxml(html, url),
+    }
+
+
+# Amazon search selectors, each one walked from the card root
+AMAZON_FLAT = [
+    "records div.s-main-slot.s-result-list > div.s-result-item",
+    "url = div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > h2:nth-child(1) > a:nth-child(1) @href",
+    "title = div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > h2:nth-child(1) > a:nth-child(1) > span:nth-child(1)",
+    "author = div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > a:nth-child(2)",
+    "avg_rating = div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(1) > span:nth-child(1) @aria-label",
+    "ratings = div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(1) > span:nth-child(2) @aria-label",
+    "book_format = div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1)",
+]
+
+
+def amazon_search():
+    html = _fixture("amazon_search.html")
+    flat = html2csv.compile_plan(AMAZON_FLAT)
+    return {
+        "flat": lambda: flat.extract(html),
+        "scoped": lambda: html2csv.load_plan("amazon_search").extract(html),
+    }
+
+
+CASES = {
+    "goodreads_book": goodreads_book,
+    "amazon_search": amazon_search,
+}
+
+
+def run(name, extractors, pages):
+    results = dict((k, fn()) for k, fn in extractors.items())
+    expected = next(iter(results.values()))
+    for k, res in results.items():
+        if res != expected:
+            print("{0}: output of {1} differs!".format(name, k))
+            return False
+
+    recs = len(expected) if isinstance(expected, list) else 1
+    for k, fn in extractors.items():
+        start = time.perf_counter()
+        for _ in range(pages):
+            fn()
+        sec = time.perf_counter() - start
+        print("{0} [{1}]: {2:.1f} pages/s, {3:.1f} records/s "
+              "({4} pages in {5:.2f}s)".format(
+                  name, k, pages / sec, pages * recs / sec, pages, sec))
+    return True
+
+
+def main(pages, names):
+    ok = True
+    for name in names or CASES:
+        ok = run(name, CASES[name](), pages) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--pages", type=int, default=200,
+                        help="No. of pages to parse with each extractor.")
+    parser.add_argument("cases", nargs="*",
+                        help="Cases to run, all by default: " +
+                        ", ".join(CASES))
+    args = parser.parse_args()
+    for case in args.cases:
+        if case not in CASES:
+            parser.error("Unknown case: "+case)
+    sys.exit(main(args.pages, args.cases))
@@ -0,0 +1,79 @@
+"""
+Measures the cold start cost of the webapp (books_app.py) and the CLI
+runner (run_scraper.py). Each module is imported in a fresh interpreter
+several times; the median import time is reported along with the heavy
+modules which got loaded on the way.
+
+Usage: python benchmarks/startup_time.py [-n RUNS] [--max-sec SEC]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TARGETS = {
+    "books_app.py": (os.path.join(ROOT, "webapp"), "books_app"),
+    "run_scraper.py": (os.path.join(ROOT, "books_scraper"), "run_scraper"),
+}
+# Modules which should only be loaded once a crawl starts
+HEAVY_MODULES = ["selenium", "requests", "urllib3", "fake_useragent"]
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+import {module}
+sec = time.perf_counter() - start
+print(json.dumps({{"sec": sec,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(path, module, work_dir):
+    code = PROBE.format(path=path, module=module, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=work_dir,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True, check=True).stdout
+    wall = time.perf_counter() - start
+    res = json.loads(out.strip().splitlines()[-1])
+    res["wall"] = wall
+    return res
+
+
+def main(runs, max_sec):
+    failed = False
+    # The webapp creates its working folders in the current directory
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, (path, module) in TARGETS.items():
+            try:
+                res = [measure(path, module, work_dir) for _ in range(runs)]
+            except subprocess.CalledProcessError as ex:
+                print("{0}: import failed.\n{1}".format(name, ex.stderr))
+                failed = True
+                continue
+            imp = statistics.median([r["sec"] for r in res])
+            wall = statistics.median([r["wall"] for r in res])
+            print("{0}: import {1:.3f}s, process {2:.3f}s (median of {3})."
+                  " Heavy modules loaded: {4}".format(
+                      name, imp, wall, runs,
+                      ", ".join(res[-1]["heavy"]) or "none"))
+            if max_sec and imp > max_sec:
+                print("{0}: import time is above {1}s!".format(name, max_sec))
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--runs", type=int, default=5,
+                        help="No. of fresh interpreters per target.")
+    parser.add_argument("--max-sec", type=float, default=None,
+                        help="Fail when a median import time is above this.")
+    args = parser.parse_args()
+    sys.exit(main(args.runs, args.max_sec))
@@ -0,0 +1,266 @@
+"""
+Pool of Selenium webdrivers shared by the crawls of a process. Starting
+a browser and logging in costs far more than loading a few shelf pages,
+so the drivers are kept running between crawls and leased to one crawl
+at a time. At most `size` browsers run; crawls beyond that wait for one
+to be returned.
+
+The Goodreads session cookies of a login are saved to a file, so that
+a new browser (e.g. after a restart) can be logged in by restoring them
+instead of submitting the login form.
+
+A lean browser (see new_driver) skips the images, media, fonts, and ad
+and tracker scripts of the pages, none of which the scrapers read.
+"""
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+import contextlib
+
+# Browsers are restarted after this many leases, to bound their memory
+MAX_USES = 50
+# A browser logged in less than this long ago is trusted to still be,
+# without loading a page to check it
+LOGIN_CHECK_SEC = 300
+# URLs a lean Chromium browser (Chrome, Edge) does not load: images,
+# media, fonts, and the ad and tracker hosts of the scraped sites
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.mp4", "*.webm", "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*doubleclick.net*", "*googlesyndication.com*", "*googletagmanager.com*",
+    "*googletagservices.com*", "*google-analytics.com*",
+    "*amazon-adsystem.com*", "*scorecardresearch.com*", "*quantserve.com*",
+    "*facebook.net*", "*moatads.com*", "*adsafeprotected.com*",
+]
+# Preferences of a lean Firefox. It has no URL blocking, so the resource
+# types are turned off and the trackers left to its tracking protection.
+LEAN_FIREFOX_PREFS = {
+    "permissions.default.image": 2,
+    "gfx.downloadable_fonts.enabled": False,
+    "media.autoplay.default": 5,
+    "privacy.trackingprotection.enabled": True,
+    "browser.cache.disk.enable": False,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "dom.ipc.processCount": 1,
+    "browser.sessionhistory.max_entries": 2,
+}
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def new_driver(web_browser, lean=False):
+    """Starts a webdriver for `web_browser`. A `lean` browser does not
+    load images, media, fonts nor the LEAN_BLOCKED_URLS, keeps no disk
+    cache and hands pages over once their document is parsed (eager page
+    load strategy), without waiting for the subresources. Selenium is
+    imported only when a browser is needed, so that ZIP extraction and
+    the webapp start without loading it.
+    """
+    from selenium import webdriver
+    if "chrome" == web_browser or "edge" == web_browser:
+        if "chrome" == web_browser:
+            from selenium.webdriver.chrome.options import Options
+        else:
+            from selenium.webdriver.edge.options import Options
+        opt = Options()
+        if lean:
+            opt.page_load_strategy = "eager"
+            opt.add_argument("--disk-cache-size=1")
+            opt.add_argument("--blink-settings=imagesEnabled=false")
+        browser = webdriver.Chrome(options=opt) if "chrome" == web_browser \
+            else webdriver.Edge(options=opt)
+        if lean:
+            try:
+                browser.execute_cdp_cmd("Network.enable", {})
+                browser.execute_cdp_cmd("Network.setBlockedURLs",
+                                        {"urls": LEAN_BLOCKED_URLS})
+            except Exception:
+                browser.quit()
+                raise
+        return browser
+    elif "firefox" == web_browser:
+        from selenium.webdriver.firefox.options import Options
+        opt = Options()
+        opt.add_argument("-headless")
+        if lean:
+            opt.page_load_strategy = "eager"
+            for name, val in LEAN_FIREFOX_PREFS.items():
+                opt.set_preference(name, val)
+        return webdriver.Firefox(options=opt)
+    elif "safari" == web_browser:
+        return webdriver.Safari()
+    raise Exception("Unsupported browser: "+str(web_browser))
+
+
+class PooledDriver(object):
+    """A running browser of the pool. `login` is the account the browser
+    is logged in with, if any, and `checked_at` the time it last was
+    known to be.
+    """
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.login = None
+        self.checked_at = 0
+        self.uses = 0
+
+    def login_checked(self, login):
+        """True if the browser was seen logged in as `login` within the
+        last LOGIN_CHECK_SEC.
+        """
+        return self.login == login and \
+            time.time() - self.checked_at < LOGIN_CHECK_SEC
+
+    def quit(self):
+        try:
+            self.browser.quit()
+        except Exception:
+            pass
+
+
+class DriverPool(object):
+    """Bounded pool of at most `size` running browsers of one type."""
+
+    def __init__(self, web_browser, size=1, log=None, lean=False):
+        self.web_browser = web_browser
+        self.lean = lean
+        self.size = max(1, int(size or 1))
+        self.log = log or (lambda msg: None)
+        self.idle = []
+        self.running = 0
+        self.cond = threading.Condition()
+
+    def _acquire(self):
+        with self.cond:
+            while not self.idle and self.running >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.running += 1
+        try:
+            self.log("Starting webdriver for "+self.web_browser)
+            return PooledDriver(new_driver(self.web_browser, self.lean))
+        except Exception:
+            with self.cond:
+                self.running -= 1
+                self.cond.notify()
+            raise
+
+    def _release(self, pd, broken=False):
+        pd.uses += 1
+        with self.cond:
+            # A pool shrunk by resize quits its browsers beyond the size
+            keep = not broken and pd.uses < MAX_USES and \
+                self.running <= self.size
+            if keep:
+                self.idle.append(pd)
+            else:
+                self.running -= 1
+            self.cond.notify()
+        if not keep:
+            pd.quit()
+
+    def resize(self, size):
+        """Sets the number of browsers the pool runs at most. Leased
+        browsers beyond a smaller size are quit once returned.
+        """
+        size = max(1, int(size or 1))
+        with self.cond:
+            if size == self.size:
+                return
+            self.log("Resizing the {0} driver pool from {1} to {2}".format(
+                self.web_browser, self.size, size))
+            self.size = size
+            extra = max(0, min(len(self.idle), self.running - size))
+            extras, self.idle = self.idle[:extra], self.idle[extra:]
+            self.running -= extra
+            self.cond.notify_all()
+        for pd in extras:
+            pd.quit()
+
+    @contextlib.contextmanager
+    def lease(self):
+        """Yields a PooledDriver for the duration of the with block. A
+        browser whose block raised is quit, since its state is unknown.
+        """
+        pd = self._acquire()
+        try:
+            yield pd
+        except BaseException:
+            self._release(pd, broken=True)
+            raise
+        self._release(pd)
+
+    def close(self):
+        """Quits the idle browsers."""
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.running -= len(idle)
+            self.cond.notify_all()
+        for pd in idle:
+            pd.quit()
+
+
+def get_driver_pool(web_browser, size=1, log=None, lean=False):
+    """Returns the pool of `web_browser` drivers (lean ones if `lean`) of
+    this process, with `size` browsers at most. An existing pool is
+    resized to `size`.
+    """
+    key = (web_browser, bool(lean))
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = DriverPool(web_browser, size, log=log, lean=bool(lean))
+            _POOLS[key] = pool
+        else:
+            pool.resize(size)
+        return pool
+
+
+@atexit.register
+def close_pools():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        pool.close()
+
+
+def cookie_file(cookie_dir, login):
+    """File keeping the session cookies of `login`."""
+    name = hashlib.sha1(str(login).encode("utf8")).hexdigest()[:12]
+    return os.path.join(cookie_dir, "cookies_{0}.json".format(name))
+
+
+def save_cookies(browser, path):
+    """Saves the cookies of the current site of `browser`, readable by
+    the owner only.
+    """
+    fd = os.open(path+".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as fp:
+        json.dump(browser.get_cookies(), fp)
+    os.replace(path+".tmp", path)
+
+
+def load_cookies(browser, path):
+    """Adds the saved cookies which have not expired to `browser`, which
+    must be on their site. Returns the number of cookies added.
+    """
+    if not os.path.isfile(path):
+        return 0
+    with open(path) as fp:
+        cookies = json.load(fp)
+    now = time.time()
+    added = 0
+    for ck in cookies:
+        if ck.get("expiry") and ck["expiry"] < now:
+            continue
+        try:
+            browser.add_cookie(ck)
+            added += 1
+        except Exception:
+            pass
+    return added
@@ -18,14 +18,20 @@ import scholarly
 from pathlib import Path
 from bs4 import BeautifulSoup
 from datetime import datetime as DT
-from fake_useragent import UserAgent
 from getpass import getpass
+# Allows importing from: ../../
+parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent)
+from books_scraper.http_client import AdaptiveRateLimiter, rate_from_delay
+from books_scraper.http_client import CircuitBreaker, RetryPolicy
+from books_scraper.http_client import get_with_retry, CircuitOpenError
+from books_scraper.http_client import USER_AGENTS as UA
+from books_scraper.sinks import CsvSink, SqliteSink, TeeSink, csv_to_parquet
 
 
 # Disable the SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-UA = UserAgent()
 FIXED_UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.14; rv:74.0) Gecko/20100101 Firefox/74.0"
 DEBUG = False
 HTTP_TIMEOUT_SEC = 5
@@ -52,12 +58,16 @@ def debug(msg):
         log(msg)
 
 
+RATE_LIMITER = AdaptiveRateLimiter(rate_from_delay(HTTP_DELAY_SEC), log=log)
+RETRY_POLICY = RetryPolicy()
+BREAKER = CircuitBreaker()
+
+
 def make_http_request(url):
-    log("Requesting URL {0}. Delay {1}s".format(url, HTTP_DELAY_SEC))
-    time.sleep(HTTP_DELAY_SEC)
-    return requests.get(url,
-                        headers={'User-Agent': UA.random},
-                        timeout=HTTP_TIMEOUT_SEC)
+    return get_with_retry(url, rate_limiter=RATE_LIMITER,
+                          retry_policy=RETRY_POLICY, breaker=BREAKER,
+                          log=log, headers={'User-Agent': UA.random},
+                          timeout=HTTP_TIMEOUT_SEC)
 
 
 def make_page_soup(page_url):
@@ -139,41 +149,61 @@ def get_book_detail(url):
         return book_info
 
 
-def main(in_file, out_file):
+def _process_row(row, dw, bc):
+    qry = urllib.parse.quote(row['title'])
+    url = "https://www.goodreads.com/search?q={0}".format(qry)
+    soup = make_page_soup(url)
+    book_url = soup.find("a", {"class": "bookTitle"})["href"]
+    if book_url:
+        book = get_book_detail(book_url.split("?")[0])
+        book["genre"] = row['genre']
+        dw.writerow(book)
+        bc.val += 1
+        print("Processed {0} books.".format(bc.val))
+    else:
+        log("*** Book URL not found!")
+
+
+def main(in_file, out_file, parquet_output=False, records_db=None):
     try:
         bc = Obj()
         with open(in_file) as incsv:
             reader = csv.DictReader(incsv)
-            with open(out_file, "w", newline='') as outcsv:
-                dw = csv.DictWriter(outcsv, ROW_KEYS, extrasaction='ignore')
+            db_sink = None
+            if records_db:
+                run = os.path.splitext(os.path.basename(out_file))[0]
+                db_sink = SqliteSink(records_db, "GOODREADS", run=run)
+            with TeeSink(CsvSink(out_file, ROW_KEYS), db_sink) as dw:
                 dw.writeheader()
                 for row in reader:
-                    try:
-                        qry = urllib.parse.quote(row['title'])
-                        url = "https://www.goodreads.com/search?q={0}".format(
-                            qry)
-                        soup = make_page_soup(url)
-                        book_url = soup.find(
-                            "a", {"class": "bookTitle"})["href"]
-                        if book_url:
-                            book = get_book_detail(book_url.split("?")[0])
-                            book["genre"] = row['genre']
-                            dw.writerow(book)
-                            bc.val += 1
-                            print("Processed {0} books.".format(bc.val))
-                        else:
-                            log("*** Book URL not found!")
-                    except Exception as ex:
-                        log("**** Error "+str(ex)+". Continuing to next.")
-                        time.sleep(15)
+                    while True:
+                        try:
+                            _process_row(row, dw, bc)
+                        except CircuitOpenError as ex:
+                            # The row is tried again once the host
+                            # accepts requests, not skipped
+                            wait_sec = BREAKER.remaining(ex.url)
+                            log("Waiting {0:.0f}s for {1} to accept "
+                                "requests.".format(wait_sec, ex.url))
+                            time.sleep(wait_sec)
+                            continue
+                        except Exception as ex:
+                            log("**** Error "+str(ex)+". Continuing to next.")
+                        break
+        if parquet_output:
+            log("Saved "+csv_to_parquet(out_file))
 
     except Exception as ex:
         log("Exiting. Error occurred. "+str(ex))
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: {0} INPUT_FILE_PATH OUTPUT_FILE_PATH".format(
+    args = [a for a in sys.argv[1:] if a != "--parquet"
+            and not a.startswith("--db=")]
+    dbs = [a[len("--db="):] for a in sys.argv[1:] if a.startswith("--db=")]
+    if len(args) != 2:
+        print("Usage: {0} [--parquet] [--db=RECORDS_DB] INPUT_FILE_PATH OUTPUT_FILE_PATH".format(
             sys.argv[0]))
     else:
-        main(sys.argv[1], sys.argv[2])
+        main(args[0], args[1], parquet_output="--parquet" in sys.argv,
+             records_db=dbs[-1] if dbs else None)
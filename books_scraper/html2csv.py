@@ -1,11 +1,53 @@
+"""
+Spec driven extraction of records from HTML pages into CSV rows.
+
+A selector file describes how to get the records of one page source,
+one statement per line (blank lines and lines starting with # are
+ignored):
+
+    records CSS_SELECTOR
+        Each element matching the selector is a record. Without this
+        line the whole page is a single record.
+
+    [!|^]NAME = CSS_SELECTOR [@ATTR | []] [| FILTER [ARG ...]] ...
+        Field NAME gets the stripped text of the first element matching
+        the selector in the record, or "--" when nothing matches. With
+        @ATTR it gets the attribute value instead, and with [] the list
+        of texts of all the matching elements. The value then goes
+        through the filters in order (see FILTERS); quoted arguments
+        may use backslash escapes. A filter returning None leaves the
+        field out, so a later line for the same field only overrides
+        an earlier one when it finds a value.
+        NAME prefixed with ! marks a required field: records without a
+        match are skipped. NAME prefixed with ^ is read from the whole
+        page instead of the record.
+
+    scope NAME = [$PARENT] CSS_SELECTOR
+        Finds the elements matching the selector in the record (or in
+        the PARENT scope) once per record. A field selector starting
+        with $NAME is then matched under those elements only, so that
+        fields sharing a long ancestor path do not walk it again each:
+
+            scope card = div.card > div:nth-child(2)
+            title = $card > h2 > a
+
+The selector file is compiled once into an ExtractionPlan whose
+selectors are precompiled XPath expressions (see lxml_engine).
+
+Usage: python -m books_scraper.html2csv SELECTOR_FILE OUT_CSV HTML_FILE [HTML_FILE ...]
+"""
 import os
-import glob
 import csv
-import re
-import lxml
-import traceback
-from pathlib import Path
-from bs4 import BeautifulSoup
+import hashlib
+import codecs
+import shlex
+import argparse
+from books_scraper import lxml_engine as LX
+
+SPEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "selectors")
+_PLANS = {}
+
 
 def get_selectors(sel_file):
     sel_list = []
@@ -14,11 +56,281 @@ def get_selectors(sel_file):
     return sel_list
 
 
-def extract_many(soup, sel):
-    pass
+def extract_many(node, sel):
+    """Stripped texts of all the elements matching `sel` under `node`."""
+    return [LX.node_text(el).strip() for el in LX.select(node, sel)]
+
+
+def extract_one(node, sel):
+    """Stripped text of the first element matching `sel` under `node`,
+    or "--".
+    """
+    return LX.get_text(node, sel)
+
+
+def _before(val, sep):
+    return val[:val.index(sep)] if sep in val else val
+
+
+def _after(val, sep):
+    return val[val.index(sep)+1:] if sep in val else "--"
+
+
+def _pick(val, *keys):
+    """Value of the first of `keys` found in a "KEY: value | ..." text."""
+    for key in keys:
+        items = [x.strip() for x in val.split("|")]
+        found = [x.split(":")[1].strip() for x in items
+                 if x.startswith(key) and ":" in x]
+        if found:
+            return found[0]
+    return "--"
+
+
+def _labelled(vals, label):
+    """Value of the last "LABEL: value" text of the list, or None."""
+    found = None
+    for txt in vals:
+        if txt.startswith(label):
+            found = txt.split(":")[1].strip()
+    return found
+
+
+# Field post-processing shared by all the selector files
+FILTERS = {
+    "strip": lambda val: val.strip(),
+    "replace": lambda val, old, new: val.replace(old, new),
+    "before": _before,
+    "after": _after,
+    "before_last": lambda val, sep: val[:val.rfind(sep)],
+    "after_last": lambda val, sep: val[val.rfind(sep)+1:],
+    "pick": _pick,
+    "join": lambda vals, sep: sep.join(vals),
+    "labelled": _labelled,
+}
+
+
+class Field(object):
+    def __init__(self, name, sel, attr=None, many=False, filters=None,
+                 required=False, page_level=False, scope=None):
+        self.name = name
+        self.sel = sel
+        self.scope = scope
+        self.xpath = LX.compile_css(sel)
+        self.attr = attr
+        self.many = many
+        self.filters = filters or []
+        self.required = required
+        self.page_level = page_level
+
+    def value(self, nodes):
+        """Returns the field value read under the first of `nodes` with
+        a match, None when it is left out, or raises LookupError when a
+        required field has no match.
+        """
+        els = []
+        for node in nodes:
+            els = self.xpath(node)
+            if els:
+                break
+        if self.required and not els:
+            raise LookupError(self.name)
+        if self.many:
+            val = [LX.node_text(el).strip() for el in els]
+        elif self.attr:
+            val = els[0].get(self.attr) if els else None
+            val = "--" if val is None else val
+        else:
+            val = LX.node_text(els[0]).strip() if els else "--"
+        for fn, args in self.filters:
+            val = fn(val, *args)
+            if val is None:
+                break
+        return val
+
+
+class Scope(object):
+    def __init__(self, name, sel, parent=None):
+        self.name = name
+        self.sel = sel
+        self.xpath = LX.compile_css(sel)
+        self.parent = parent
+
+
+class ExtractionPlan(object):
+    """Compiled form of a selector file."""
+
+    def __init__(self, records_sel, fields, scopes=None, version=None):
+        self.records_sel = records_sel
+        # Fingerprint of the selector file the plan was compiled from
+        self.version = version
+        self.records_xpath = LX.compile_css(records_sel) \
+            if records_sel else None
+        self.fields = fields
+        self.scopes = scopes or []
+
+    def extract_doc(self, doc):
+        """Returns the records of a parsed page."""
+        page = {}
+        for f in self.fields:
+            if f.page_level:
+                val = f.value([doc])
+                if val is not None:
+                    page[f.name] = val
+
+        nodes = self.records_xpath(doc) if self.records_xpath else [doc]
+        data = []
+        for node in nodes:
+            rec = dict(page)
+            ctx = {None: [node]}
+            for sc in self.scopes:
+                found = []
+                for parent in ctx[sc.parent]:
+                    found.extend(sc.xpath(parent))
+                ctx[sc.name] = found
+            try:
+                for f in self.fields:
+                    if f.page_level:
+                        continue
+                    val = f.value(ctx[f.scope])
+                    if val is not None:
+                        rec[f.name] = val
+            except LookupError:
+                continue
+            data.append(rec)
+        return data
+
+    def extract(self, html):
+        """Returns the records of a page given as bytes or str."""
+        return self.extract_doc(LX.parse_html(html))
+
+    def extract_batch(self, pages):
+        """Yields the records of each of the given pages, in order."""
+        for html in pages:
+            yield self.extract(html)
+
+
+def _tokens(line):
+    lex = shlex.shlex(line, posix=True, punctuation_chars="|")
+    lex.whitespace_split = True
+    lex.commenters = ""
+    return list(lex)
+
+
+def _split_scope(sel_toks, scopes, line):
+    """Returns the scope named by a leading $NAME and the rest of the
+    selector tokens.
+    """
+    if not sel_toks or not sel_toks[0].startswith("$"):
+        return None, sel_toks
+    name = sel_toks[0][1:]
+    if name not in scopes:
+        raise ValueError("Unknown scope in: "+line)
+    return name, sel_toks[1:]
+
+
+def compile_plan(sel_lines):
+    """Compiles the lines of a selector file into an ExtractionPlan."""
+    sel_lines = list(sel_lines)
+    records_sel, fields, scopes = None, [], []
+    scope_names = set()
+    for line in sel_lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("records "):
+            records_sel = line[len("records "):].strip()
+            continue
+
+        toks = _tokens(line)
+        if toks[0] == "scope":
+            if len(toks) < 4 or toks[2] != "=":
+                raise ValueError("Invalid scope line: "+line)
+            parent, sel_toks = _split_scope(toks[3:], scope_names, line)
+            if not sel_toks:
+                raise ValueError("Missing selector: "+line)
+            scopes.append(Scope(toks[1], " ".join(sel_toks), parent))
+            scope_names.add(toks[1])
+            continue
+        if len(toks) < 3 or toks[1] != "=":
+            raise ValueError("Invalid selector line: "+line)
+        name = toks[0]
+        required, page_level = name.startswith("!"), name.startswith("^")
+        name = name.lstrip("!^")
+
+        parts, cur = [], []
+        for t in toks[2:]:
+            if t == "|":
+                parts.append(cur)
+                cur = []
+            else:
+                cur.append(t)
+        parts.append(cur)
+
+        sel_toks, attr, many = parts[0], None, False
+        if sel_toks and sel_toks[-1] == "[]":
+            many, sel_toks = True, sel_toks[:-1]
+        elif sel_toks and sel_toks[-1].startswith("@"):
+            attr, sel_toks = sel_toks[-1][1:], sel_toks[:-1]
+        scope, sel_toks = _split_scope(sel_toks, scope_names, line)
+        if not sel_toks:
+            raise ValueError("Missing selector: "+line)
+        if scope and page_level:
+            raise ValueError("Page fields cannot use a scope: "+line)
+
+        filters = []
+        for p in parts[1:]:
+            if not p or p[0] not in FILTERS:
+                raise ValueError("Unknown filter in: "+line)
+            args = [codecs.decode(a, "unicode_escape") for a in p[1:]]
+            filters.append((FILTERS[p[0]], args))
+
+        fields.append(Field(name, " ".join(sel_toks), attr=attr, many=many,
+                            filters=filters, required=required,
+                            page_level=page_level, scope=scope))
+    version = hashlib.sha1("".join(sel_lines).encode("utf8")).hexdigest()
+    return ExtractionPlan(records_sel, fields, scopes, version[:16])
+
+
+def load_plan(source):
+    """Returns the compiled plan of `source`: a selector file path, or
+    the name of one of the bundled selector files. Plans are compiled
+    only once.
+    """
+    plan = _PLANS.get(source)
+    if plan is None:
+        sel_file = source if os.path.isfile(source) else \
+            os.path.join(SPEC_DIR, source+".sel")
+        plan = compile_plan(get_selectors(sel_file))
+        _PLANS[source] = plan
+    return plan
+
+
+def main(sel_file, out_csv, html_files):
+    plan = load_plan(sel_file)
+    keys = []
+    for f in plan.fields:
+        if f.name not in keys:
+            keys.append(f.name)
 
-def extract_one(soup, sel):
-    pass
+    def pages():
+        for path in html_files:
+            with open(path, "rb") as fp:
+                yield fp.read()
 
+    with open(out_csv, "w", newline='') as csvfile:
+        dw = csv.DictWriter(csvfile, keys, extrasaction='ignore')
+        dw.writeheader()
+        for data in plan.extract_batch(pages()):
+            dw.writerows(data)
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("sel_file", type=str,
+                        help="Selector file path or bundled selector name.")
+    parser.add_argument("out_csv", type=str, help="Output CSV file path.")
+    parser.add_argument("html_files", type=str, nargs="+",
+                        help="HTML files to extract records from.")
+    args = parser.parse_args()
+    main(args.sel_file, args.out_csv, args.html_files)
@@ -0,0 +1,541 @@
+"""
+HTTP plumbing shared by the scrapers: pooled sessions, request pacing
+per host, retries, circuit breakers and User-Agent rotation.
+"""
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+POOL_SIZE = 10
+# Responses worth retrying since the server may recover from them
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+_SESSION = None
+_SESSION_POOL_SIZE = None
+_SESSION_LOCK = threading.Lock()
+_PACING = None
+_PACING_LOCK = threading.Lock()
+# Page loads per second of the browser paths, see PacingPolicy
+PAGES_PER_SEC = {"goodreads": 0.5, "scholar": 0.2}
+DEFAULT_PAGES_PER_SEC = 0.5
+# Rotation list used when no User-Agent file is configured
+BUNDLED_USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/83.0.4103.116 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) "
+    "Gecko/20100101 Firefox/78.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_5) AppleWebKit/605.1.15 "
+    "(KHTML, like Gecko) Version/13.1.1 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.14; rv:74.0) "
+    "Gecko/20100101 Firefox/74.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/83.0.4103.97 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/83.0.4103.61 Safari/537.36",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:77.0) "
+    "Gecko/20100101 Firefox/77.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/83.0.4103.106 Safari/537.36 Edg/83.0.478.54",
+)
+
+
+class FetchError(Exception):
+    """Raised when a page could not be fetched. `retryable` tells whether
+    a later attempt may succeed.
+    """
+
+    def __init__(self, url, reason, retryable=True):
+        super(FetchError, self).__init__(
+            "Failed to get page at URL {0}. Error: {1}".format(url, reason))
+        self.url = url
+        self.retryable = retryable
+
+
+class CircuitOpenError(FetchError):
+    """Raised instead of sending a request to a host whose circuit
+    breaker is open.
+    """
+
+    def __init__(self, url, remaining_sec):
+        super(CircuitOpenError, self).__init__(
+            url, "host paused for {0:.0f}s more".format(remaining_sec))
+
+
+class UserAgentPool(object):
+    """User-Agent strings to rotate through. They are read from `ua_file`
+    (one per line) when it exists, otherwise the bundled list is used.
+    Nothing is loaded until the first `random` lookup, i.e. the first
+    live HTTP request.
+    """
+
+    def __init__(self, ua_file=None):
+        self.ua_file = ua_file
+        self.agents = None
+        self.lock = threading.Lock()
+
+    def configure(self, ua_file):
+        with self.lock:
+            self.ua_file = ua_file
+            self.agents = None
+
+    def _load(self):
+        agents = []
+        if self.ua_file and os.path.exists(self.ua_file):
+            with open(self.ua_file, "r") as fp:
+                agents = [x.strip() for x in fp if x.strip()]
+        return agents or list(BUNDLED_USER_AGENTS)
+
+    @property
+    def random(self):
+        with self.lock:
+            if self.agents is None:
+                self.agents = self._load()
+            return random.choice(self.agents)
+
+
+USER_AGENTS = UserAgentPool()
+
+
+class TokenBucket(object):
+    """Token bucket which allows `rate` acquisitions per second with
+    bursts of up to `burst` acquisitions.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.not_before = 0.0
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def pause(self, seconds):
+        """No token is handed out for the next `seconds` seconds."""
+        with self.lock:
+            self.not_before = max(self.not_before,
+                                  time.monotonic() + seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, cost=1.0):
+        """Blocks until `cost` tokens are available and consumes them.
+        The bucket never holds more than `burst` tokens, so a larger cost
+        waits for a full bucket and borrows the rest from the next tokens.
+        Returns the number of seconds spent waiting.
+        """
+        need = min(cost, self.burst)
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                paused_sec = self.not_before - self.last
+                if paused_sec <= 0 and self.tokens >= need:
+                    self.tokens -= cost
+                    return waited
+                wait_sec = max(paused_sec, (need - self.tokens) / self.rate)
+            time.sleep(wait_sec)
+            waited += wait_sec
+
+
+class HostRateLimiter(object):
+    """Keeps one token bucket per host so that the request budget of
+    one website does not throttle requests sent to another one.
+    A `rate` of None (or <= 0) disables the rate limiting.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def wait(self, url):
+        if not self.rate or self.rate <= 0:
+            return 0.0
+        return self.bucket(urlparse(url).netloc).acquire()
+
+    def on_response(self, url, status, latency, retry_after=None):
+        """Called with the outcome of every request. The fixed limiter
+        does not adapt to it.
+        """
+        pass
+
+    def on_error(self, url, ex):
+        """Called when a request fails without a response."""
+        pass
+
+
+class AdaptiveRateLimiter(HostRateLimiter):
+    """Host rate limiter driven by AIMD (additive increase, multiplicative
+    decrease). The rate of a host grows by `increase` requests/sec after
+    every fast 200 response, and is multiplied by `decrease` on 429/503
+    responses, connection errors or when the latency rises above
+    `latency_factor` times its moving average. `Retry-After` headers
+    pause the host for the requested time.
+    """
+
+    def __init__(self, rate, min_rate=None, max_rate=None, increase=None,
+                 decrease=0.5, latency_factor=2.0, burst=1, log=print):
+        super(AdaptiveRateLimiter, self).__init__(rate, burst)
+        self.log = log
+        rate = rate or 0
+        self.min_rate = min_rate or rate / 10.0
+        self.max_rate = max_rate or rate * 4.0
+        self.increase = increase or rate / 10.0
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.avg_latency = {}
+
+    def _adjust(self, host, rate):
+        rate = min(self.max_rate, max(self.min_rate, rate))
+        self.bucket(host).set_rate(rate)
+        return rate
+
+    def on_response(self, url, status, latency, retry_after=None):
+        if not self.rate or self.rate <= 0:
+            return
+        host = urlparse(url).netloc
+        bucket = self.bucket(host)
+        with self.lock:
+            avg = self.avg_latency.get(host, latency)
+            self.avg_latency[host] = 0.8 * avg + 0.2 * latency
+        if status in (429, 503):
+            rate = self._adjust(host, bucket.rate * self.decrease)
+            pause_sec = parse_retry_after(retry_after)
+            if pause_sec:
+                bucket.pause(pause_sec)
+            self.log("Throttled by {0} (HTTP {1}). Rate {2:.2f}/s, "
+                     "pausing {3}s.".format(host, status, rate, pause_sec or 0))
+        elif latency > self.latency_factor * avg:
+            rate = self._adjust(host, bucket.rate * self.decrease)
+            self.log("Latency of {0} rose to {1:.2f}s. Rate {2:.2f}/s.".format(
+                host, latency, rate))
+        elif status in (200, 304):
+            self._adjust(host, bucket.rate + self.increase)
+
+    def on_error(self, url, ex):
+        if not self.rate or self.rate <= 0:
+            return
+        host = urlparse(url).netloc
+        rate = self._adjust(host, self.bucket(host).rate * self.decrease)
+        self.log("Request to {0} failed ({1}). Rate {2:.2f}/s.".format(
+            host, type(ex).__name__, rate))
+
+
+class PacingPolicy(object):
+    """Politeness delay between the page loads of the browser paths. It
+    is kept apart from the detection of a loaded page, which is an
+    explicit wait for an element of the page. `pages_per_sec` maps a
+    source (e.g. goodreads, scholar) to its budget of page loads per
+    second, PAGES_PER_SEC by default. The jitter is drawn by the limiter
+    itself: each load costs a random 1 +/- `jitter` tokens, so the loads
+    are spaced 1/rate seconds apart on average.
+    """
+
+    def __init__(self, pages_per_sec=None, jitter=0.5, log=print):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.configure(pages_per_sec, jitter, log)
+
+    def configure(self, pages_per_sec=None, jitter=0.5, log=print):
+        """Sets the page budgets and jitter. The buckets already in use
+        keep their tokens and take the new rates.
+        """
+        with self.lock:
+            self.pages_per_sec = dict(PAGES_PER_SEC)
+            self.pages_per_sec.update(pages_per_sec or {})
+            self.jitter = min(max(float(jitter), 0.0), 1.0)
+            self.log = log
+            for source, bucket in self.buckets.items():
+                bucket.set_rate(float(self.pages_per_sec.get(
+                    source, DEFAULT_PAGES_PER_SEC) or 0))
+
+    def bucket(self, source):
+        with self.lock:
+            if source not in self.buckets:
+                rate = self.pages_per_sec.get(source, DEFAULT_PAGES_PER_SEC)
+                self.buckets[source] = TokenBucket(float(rate or 0))
+            return self.buckets[source]
+
+    def wait(self, source):
+        """Blocks until the next page of `source` may be loaded. Returns
+        the number of seconds spent waiting.
+        """
+        bucket = self.bucket(source)
+        if bucket.rate <= 0:
+            return 0.0
+        cost = random.uniform(1 - self.jitter, 1 + self.jitter)
+        waited = bucket.acquire(cost)
+        if waited:
+            self.log("Paced {0} page load by {1:.2f}s".format(source, waited))
+        return waited
+
+
+def configure_pacing(pages_per_sec=None, jitter=0.5, log=print):
+    """Returns the PacingPolicy shared by all the scrapers of the process,
+    so that concurrent jobs split one budget of page loads per source
+    instead of each having its own. It is created on first use and
+    reconfigured with the given settings afterwards.
+    """
+    global _PACING
+    with _PACING_LOCK:
+        if _PACING is None:
+            _PACING = PacingPolicy(pages_per_sec, jitter=jitter, log=log)
+        else:
+            _PACING.configure(pages_per_sec, jitter=jitter, log=log)
+        return _PACING
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter for idempotent requests: the
+    n-th retry waits a random time of up to `base_delay` * 2^n seconds,
+    capped at `max_delay`.
+    """
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=60.0):
+        self.max_retries = int(max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker(object):
+    """Pauses a host for `reset_sec` seconds once `max_failures`
+    consecutive requests to it have failed. After the pause the circuit
+    is half open: one trial request is let through (see allow) while the
+    others wait. Its success closes the circuit again, its failure opens
+    it for another `reset_sec` seconds. A trial which never reports back
+    is given up after `reset_sec` seconds.
+    """
+
+    def __init__(self, max_failures=5, reset_sec=60):
+        self.max_failures = int(max_failures)
+        self.reset_sec = reset_sec
+        self.failures = {}
+        self.open_until = {}
+        # Start time of the trial request of a half open host
+        self.trial = {}
+        self.lock = threading.Lock()
+
+    def _remaining(self, host, now):
+        until = self.open_until.get(host)
+        if until is None:
+            return 0.0
+        if until > now:
+            return until - now
+        started = self.trial.get(host)
+        if started is not None and now - started < self.reset_sec:
+            return started + self.reset_sec - now
+        return 0.0
+
+    def remaining(self, url):
+        """Seconds until a request to the host of `url` may be sent."""
+        with self.lock:
+            return self._remaining(urlparse(url).netloc, time.monotonic())
+
+    def allow(self, url):
+        """Returns 0 when a request to the host of `url` may be sent now,
+        else the seconds to wait. Once the pause is over only the first
+        caller is allowed, as the trial request.
+        """
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        with self.lock:
+            wait_sec = self._remaining(host, now)
+            if wait_sec <= 0 and host in self.open_until:
+                self.trial[host] = now
+            return wait_sec
+
+    def record_success(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            self.failures[host] = 0
+            self.open_until.pop(host, None)
+            self.trial.pop(host, None)
+
+    def record_failure(self, url):
+        """Returns True when this failure opened the circuit."""
+        host = urlparse(url).netloc
+        with self.lock:
+            count = self.failures.get(host, 0) + 1
+            if self.trial.pop(host, None) is not None or \
+                    count >= self.max_failures:
+                self.failures[host] = 0
+                self.open_until[host] = time.monotonic() + self.reset_sec
+                return True
+            self.failures[host] = count
+        return False
+
+
+def parse_retry_after(value):
+    """Returns the seconds asked for by a Retry-After header, which is
+    either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def conditional_headers(validators):
+    """Request headers revalidating a cached page whose validators are
+    (etag, last_modified).
+    """
+    headers = {}
+    etag, last_modified = validators or (None, None)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+
+def rate_from_delay(http_delay_sec):
+    """Converts the legacy fixed delay between requests into an
+    equivalent requests-per-second budget.
+    """
+    delay = float(http_delay_sec or 0)
+    return 1.0 / delay if delay > 0 else None
+
+
+def make_session(pool_size=POOL_SIZE):
+    """Creates a session which keeps up to `pool_size` alive connections
+    per host and asks for compressed responses. The requests stack is
+    imported here, i.e. on the first live HTTP fetch.
+    """
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    # Disable the SSL warnings
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size,
+                          pool_maxsize=pool_size)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    sess.headers.update({"Accept-Encoding": "gzip, deflate",
+                         "Connection": "keep-alive"})
+    return sess
+
+
+def configure_session(pool_size=POOL_SIZE):
+    """Replaces the shared session with one using the given pool size.
+    The old session is not closed since other jobs may still be using it.
+    """
+    global _SESSION, _SESSION_POOL_SIZE
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION_POOL_SIZE != pool_size:
+            _SESSION = make_session(pool_size)
+            _SESSION_POOL_SIZE = pool_size
+        return _SESSION
+
+
+def get_session():
+    """Returns the session shared by all the fetch paths. It is created
+    on first use.
+    """
+    global _SESSION, _SESSION_POOL_SIZE
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = make_session()
+            _SESSION_POOL_SIZE = POOL_SIZE
+        return _SESSION
+
+
+def cookie_jar(cookies):
+    """Cookie jar for requests holding cookies exported from a webdriver
+    (browser.get_cookies()), e.g. the session of a login done there.
+    """
+    from requests.cookies import RequestsCookieJar
+    jar = RequestsCookieJar()
+    for ck in cookies:
+        jar.set(ck["name"], ck["value"], domain=ck.get("domain", ""),
+                path=ck.get("path", "/"), secure=ck.get("secure", False))
+    return jar
+
+
+def timed_get(url, rate_limiter=None, session=None, **kwargs):
+    """GETs the URL through `session`, the shared one by default, and
+    reports the outcome and latency of the request to the rate limiter.
+    """
+    import requests
+    start = time.monotonic()
+    try:
+        resp = (session or get_session()).get(url, **kwargs)
+    except requests.exceptions.RequestException as ex:
+        if rate_limiter:
+            rate_limiter.on_error(url, ex)
+        raise
+    if rate_limiter:
+        rate_limiter.on_response(url, resp.status_code,
+                                 time.monotonic() - start,
+                                 resp.headers.get("Retry-After"))
+    return resp
+
+
+def get_with_retry(url, rate_limiter=None, retry_policy=None, breaker=None,
+                   log=print, **kwargs):
+    """GETs the URL, retrying connection errors and the RETRY_STATUSES
+    as allowed by the retry policy. Raises CircuitOpenError without
+    sending anything when the host is paused by the breaker. The last
+    response is returned when retries run out; a connection error is
+    raised as a FetchError.
+    """
+    import requests
+    attempts = 1 + (retry_policy.max_retries if retry_policy else 0)
+    for attempt in range(attempts):
+        wait_sec = breaker.allow(url) if breaker else 0.0
+        if wait_sec > 0:
+            raise CircuitOpenError(url, wait_sec)
+        waited = rate_limiter.wait(url) if rate_limiter else 0.0
+        log("Requesting URL {0}. Waited {1:.2f}s".format(url, waited))
+        try:
+            resp = timed_get(url, rate_limiter=rate_limiter, **kwargs)
+            failed = resp.status_code in RETRY_STATUSES
+        except requests.exceptions.RequestException as ex:
+            resp, failed = ex, True
+
+        if not failed:
+            if breaker:
+                breaker.record_success(url)
+            return resp
+        if breaker and breaker.record_failure(url):
+            log("Pausing requests to {0} for {1}s after {2} failures.".format(
+                urlparse(url).netloc, breaker.reset_sec, breaker.max_failures))
+        if attempt + 1 < attempts:
+            delay = retry_policy.delay(attempt)
+            log("Attempt {0} for {1} failed. Retrying in {2:.2f}s.".format(
+                attempt + 1, url, delay))
+            time.sleep(delay)
+
+    if isinstance(resp, Exception):
+        raise FetchError(url, resp) from resp
+    return resp
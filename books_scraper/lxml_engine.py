@@ -0,0 +1,194 @@
+"""
+Extraction helpers working directly on lxml.html trees. CSS selectors
+are compiled once into lxml XPath objects, and text is read the way
+BeautifulSoup's `.text` reads it, so that the extracted values are the
+same as with the BeautifulSoup based extractors.
+
+Only the subset of CSS used by the extractors is supported: type, `*`,
+`#id`, `.class`, `:nth-child(n)`, `:nth-last-child(n)`, and the
+descendant and child combinators. A selector starting with `>` is
+relative: its first step selects children of the context node.
+
+Pages can also be cut down to the regions an extractor reads before
+they are parsed (see slice_regions), so that the tree of the rest of
+the page (scripts, reviews, navigation) is never built.
+"""
+import re
+from lxml import etree
+import lxml.html
+
+# Descendants of these tags are skipped by BeautifulSoup's `.text`
+_SKIP_TEXT_TAGS = ("script", "style", "template")
+_TOKEN_RE = re.compile(
+    r"\s*(>)\s*|(\s+)|([A-Za-z][\w-]*|\*)|#([\w-]+)|\.([\w-]+)"
+    r"|:nth-child\((\d+)\)|:nth-last-child\((\d+)\)")
+_COMPILED = {}
+# Tags, comments and scripts met while looking for the end of a region
+_MARKUP_RE = re.compile(
+    r"<!--.*?-->|<script\b.*?</script\s*>|<(/?)([A-Za-z][\w-]*)\b[^>]*>",
+    re.S | re.I)
+
+
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {0} ')".format(
+        name)
+
+
+def css_to_xpath(sel):
+    """Translates a CSS selector into an XPath expression selecting the
+    matching descendants of the context node.
+    """
+    steps = []
+    tag, preds = None, []
+    axis = "descendant::"
+    pos = 0
+    sel = sel.strip()
+    if sel.startswith(">"):
+        axis, sel = "", sel[1:].strip()
+    while pos < len(sel):
+        m = _TOKEN_RE.match(sel, pos)
+        if not m or m.end() == pos:
+            raise ValueError("Unsupported CSS selector: "+sel)
+        pos = m.end()
+        child, space, name, id_, cls, nth, nth_last = m.groups()
+        if child or space:
+            steps.append(axis + (tag or "*") + "".join(preds))
+            tag, preds = None, []
+            axis = "" if child else "descendant::"
+        elif name:
+            tag = name
+        elif id_:
+            preds.append("[@id='{0}']".format(id_))
+        elif cls:
+            preds.append("[{0}]".format(_has_class(cls)))
+        elif nth:
+            preds.append(
+                "[count(preceding-sibling::*)={0}]".format(int(nth) - 1))
+        elif nth_last:
+            preds.append(
+                "[count(following-sibling::*)={0}]".format(int(nth_last) - 1))
+    steps.append(axis + (tag or "*") + "".join(preds))
+    return "/".join(steps)
+
+
+def compile_css(sel):
+    """Returns the compiled XPath for a CSS selector. Compiled selectors
+    are kept, so each one is translated only once.
+    """
+    xp = _COMPILED.get(sel)
+    if xp is None:
+        xp = etree.XPath(css_to_xpath(sel))
+        _COMPILED[sel] = xp
+    return xp
+
+
+def parse_html(html):
+    """Parses a page given as bytes or str into an lxml document."""
+    if isinstance(html, str):
+        html = html.encode("utf8")
+    try:
+        html.decode("utf8")
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+    except UnicodeDecodeError:
+        parser = lxml.html.HTMLParser()
+    return lxml.html.document_fromstring(html, parser=parser).getroottree()
+
+
+def node_text(el):
+    """Text of the element and its descendants, like BeautifulSoup's
+    `.text`: comments and the content of nested scripts and styles are
+    left out.
+    """
+    parts = []
+    _collect_text(el, parts)
+    return "".join(parts)
+
+
+def _collect_text(el, parts):
+    if el.text:
+        parts.append(el.text)
+    for child in el:
+        if isinstance(child.tag, str) and child.tag not in _SKIP_TEXT_TAGS:
+            _collect_text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+
+
+def select(node, sel):
+    return compile_css(sel)(node)
+
+
+def select_one(node, sel):
+    found = compile_css(sel)(node)
+    return found[0] if found else None
+
+
+def get_text(node, sel, default="--"):
+    """Stripped text of the first match of `sel`, like try_get_item."""
+    el = select_one(node, sel)
+    return node_text(el).strip() if el is not None else default
+
+
+def _region_start_re(region):
+    kind, name = region[0], re.escape(region[1:])
+    # The attribute name follows whitespace, so that e.g. data-id= is not
+    # taken for id=
+    if kind == "#":
+        attr = r"""(?<=\s)id\s*=\s*["']?{0}(?=["'\s>])""".format(name)
+    elif kind == ".":
+        attr = r"""(?<=\s)class\s*=\s*["'][^"']*(?<![\w-]){0}(?![\w-])""".format(
+            name)
+    else:
+        raise ValueError("Unsupported region: "+region)
+    return re.compile(r"<([A-Za-z][\w-]*)\b[^>]*?" + attr, re.I)
+
+
+def _region_end(html, start, tag):
+    """Offset just past the end tag closing the element opened at
+    `start`, or -1 when it is not closed.
+    """
+    depth = 0
+    tag = tag.lower()
+    for m in _MARKUP_RE.finditer(html, start):
+        if not m.group(2) or m.group(2).lower() != tag:
+            continue
+        depth += -1 if m.group(1) else 1
+        if depth == 0:
+            return m.end()
+    return -1
+
+
+def slice_regions(html, regions):
+    """Returns a page made of only the elements of `html` matching the
+    `regions` ("#id" or ".class", first match each), in page order. The
+    page is returned whole when it is not UTF-8 or when none of the
+    regions could be cut out, so extraction then works as before.
+
+    >>> slice_regions('<p data-id="d">No</p><div id="d">Yes</div>', ["#d"])
+    '<html><body><div id="d">Yes</div></body></html>'
+    >>> slice_regions('<p data-class="c">No</p><p class="a c">Yes</p>', [".c"])
+    '<html><body><p class="a c">Yes</p></body></html>'
+    """
+    if isinstance(html, bytes):
+        try:
+            html = html.decode("utf8")
+        except UnicodeDecodeError:
+            return html
+    spans = []
+    for region in regions:
+        m = _region_start_re(region).search(html)
+        if not m:
+            continue
+        end = _region_end(html, m.start(), m.group(1))
+        if end < 0:
+            return html
+        spans.append((m.start(), end))
+    if not spans:
+        return html
+    parts, last = [], -1
+    for start, end in sorted(spans):
+        # A region inside another one is already in the page
+        if start >= last:
+            parts.append(html[start:end])
+            last = end
+    return "<html><body>" + "\n".join(parts) + "</body></html>"
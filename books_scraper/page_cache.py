@@ -0,0 +1,401 @@
+"""
+Store for the downloaded HTML pages. Pages are kept zlib compressed in a
+SQLite database, deduplicated by the SHA-256 of their content, with an
+index of URL -> content hash, fetch time and HTTP status.
+
+Records extracted from a page can be kept next to it, keyed by the page
+content hash and the extractor name and version, so that a page which
+did not change is not parsed again. Records of content which is not
+stored as a page (e.g. the entries of an uploaded ZIP file) count
+towards the size of the store and are evicted on their own.
+
+The store is bounded: a page expires once it is older than the TTL of
+its page type, and the least recently used pages are evicted when the
+compressed content grows beyond `max_bytes`. Expired pages which have
+HTTP validators (ETag, Last-Modified) are kept so that they can be
+revalidated with a conditional GET instead of downloaded again, until
+they are `stale_factor` times older than their TTL.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+DB_FILE = "pages.db"
+DAY_SEC = 24 * 3600
+# Shelf listings change often, book pages rarely
+DEFAULT_TTL_SEC = {"shelf": DAY_SEC, "book": 30 * DAY_SEC, "page": 7 * DAY_SEC,
+                   "record": 30 * DAY_SEC}
+# Eviction runs on the first store of a PageCache, then after this many
+# more, and whenever the store outgrows max_bytes
+EVICT_EVERY = 100
+EVICT_BATCH = 200
+# Expired pages with validators are kept up to this many times their TTL
+STALE_FACTOR = 4
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    fetched_at REAL NOT NULL,
+    status INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS pages_hash ON pages(hash);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    val INTEGER NOT NULL);
+INSERT OR IGNORE INTO meta(key, val)
+    SELECT 'stored_bytes', COALESCE(SUM(LENGTH(data)), 0) FROM blobs;
+CREATE TABLE IF NOT EXISTS records (
+    hash TEXT NOT NULL,
+    extractor TEXT NOT NULL,
+    version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (hash, extractor));
+CREATE TRIGGER IF NOT EXISTS blobs_added AFTER INSERT ON blobs BEGIN
+    UPDATE meta SET val = val + LENGTH(NEW.data) WHERE key='stored_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS blobs_removed AFTER DELETE ON blobs BEGIN
+    UPDATE meta SET val = val - LENGTH(OLD.data) WHERE key='stored_bytes';
+END;
+"""
+# Columns added to the pages table after its first version
+PAGE_COLUMNS = [
+    ("page_type", "TEXT NOT NULL DEFAULT 'page'"),
+    ("accessed_at", "REAL NOT NULL DEFAULT 0"),
+    ("etag", "TEXT"),
+    ("last_modified", "TEXT"),
+]
+# Columns added to the records table after its first version
+RECORD_COLUMNS = [
+    ("accessed_at", "REAL NOT NULL DEFAULT 0"),
+]
+INDEXES = """
+CREATE INDEX IF NOT EXISTS pages_accessed ON pages(accessed_at);
+CREATE INDEX IF NOT EXISTS pages_type_fetched ON pages(page_type, fetched_at);
+CREATE INDEX IF NOT EXISTS records_accessed ON records(accessed_at);
+CREATE TRIGGER IF NOT EXISTS records_added AFTER INSERT ON records BEGIN
+    UPDATE meta SET val = val + LENGTH(NEW.data) WHERE key='stored_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS records_updated AFTER UPDATE OF data ON records
+BEGIN
+    UPDATE meta SET val = val + LENGTH(NEW.data) - LENGTH(OLD.data)
+        WHERE key='stored_bytes';
+END;
+CREATE TRIGGER IF NOT EXISTS records_removed AFTER DELETE ON records BEGIN
+    UPDATE meta SET val = val - LENGTH(OLD.data) WHERE key='stored_bytes';
+END;
+"""
+
+
+class PageCache(object):
+    """Compressed, content-addressed page store kept in `cache_dir`.
+    The database is opened on first use and shared by the threads of a
+    scraper. `ttl_sec` maps page types to their time to live in seconds,
+    and "record" to the time a record without a stored page is kept
+    unused; `max_bytes` of None leaves the size unbounded.
+    """
+
+    def __init__(self, cache_dir, compress_level=6, max_bytes=None,
+                 ttl_sec=None, stale_factor=STALE_FACTOR):
+        self.cache_dir = cache_dir
+        self.db_path = os.path.join(cache_dir, DB_FILE)
+        self.compress_level = compress_level
+        self.max_bytes = max_bytes
+        self.ttl_sec = dict(DEFAULT_TTL_SEC)
+        self.ttl_sec.update(ttl_sec or {})
+        self.stale_factor = max(1.0, float(stale_factor))
+        self.puts = 0
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _db(self):
+        if self.conn is None:
+            # Other jobs may write to the same store, hence the WAL
+            # journal and the generous lock timeout.
+            self.conn = sqlite3.connect(self.db_path, timeout=30,
+                                        check_same_thread=False)
+            # Lets a new database give the space of evicted pages back
+            self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+            cols = [r[1] for r in self.conn.execute("PRAGMA table_info(pages)")]
+            for name, decl in PAGE_COLUMNS:
+                if name not in cols:
+                    self.conn.execute(
+                        "ALTER TABLE pages ADD COLUMN {0} {1}".format(name, decl))
+            cols = [r[1] for r in self.conn.execute(
+                "PRAGMA table_info(records)")]
+            for name, decl in RECORD_COLUMNS:
+                if name not in cols:
+                    # Records stored before accessed_at were not counted
+                    # in stored_bytes, which the triggers keep from now on
+                    count = """UPDATE meta SET val = val + (SELECT
+                        COALESCE(SUM(LENGTH(data)), 0) FROM records)
+                        WHERE key='stored_bytes';"""
+                    self.conn.executescript(
+                        "BEGIN; ALTER TABLE records ADD COLUMN {0} {1}; {2} "
+                        "COMMIT;".format(name, decl,
+                                         count if name == "accessed_at" else ""))
+            self.conn.executescript(INDEXES)
+        return self.conn
+
+    def _ttl(self, page_type):
+        return self.ttl_sec.get(page_type, self.ttl_sec["page"])
+
+    def contains(self, url):
+        with self.lock:
+            row = self._db().execute(
+                "SELECT fetched_at, page_type FROM pages WHERE url=?",
+                (url,)).fetchone()
+        return row is not None and time.time() - row[0] <= self._ttl(row[1])
+
+    def get(self, url):
+        """Returns the cached page content for `url`, or None when it is
+        missing or expired.
+        """
+        return self.get_with_hash(url)[0]
+
+    def get_with_hash(self, url):
+        """Returns the cached page content for `url` and its content
+        hash, or (None, None) when it is missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            conn = self._db()
+            row = conn.execute(
+                """SELECT b.data, p.fetched_at, p.page_type, p.hash
+                FROM pages p JOIN blobs b ON b.hash=p.hash WHERE p.url=?""",
+                (url,)).fetchone()
+            if not row or now - row[1] > self._ttl(row[2]):
+                return None, None
+            self._touch(conn, url, now)
+        return zlib.decompress(row[0]).decode("utf8"), row[3]
+
+    def _touch(self, conn, url, now):
+        with conn:
+            conn.execute("UPDATE pages SET accessed_at=? WHERE url=?",
+                         (now, url))
+
+    def get_record(self, url, extractor, version):
+        """Returns the record which `version` of `extractor` got from the
+        cached page of `url`, or None.
+        """
+        now = time.time()
+        with self.lock:
+            conn = self._db()
+            row = conn.execute(
+                """SELECT r.data, p.fetched_at, p.page_type FROM pages p
+                JOIN records r ON r.hash=p.hash AND r.extractor=?
+                AND r.version=? WHERE p.url=?""",
+                (extractor, version, url)).fetchone()
+            if not row or now - row[1] > self._ttl(row[2]):
+                return None
+            self._touch(conn, url, now)
+        return json.loads(row[0])
+
+    def get_hash_record(self, digest, extractor, version):
+        """Returns the record which `version` of `extractor` got from the
+        page content with hash `digest`, or None.
+        """
+        with self.lock:
+            conn = self._db()
+            row = conn.execute(
+                """SELECT data FROM records WHERE hash=? AND extractor=?
+                AND version=?""", (digest, extractor, version)).fetchone()
+            if row:
+                with conn:
+                    conn.execute("""UPDATE records SET accessed_at=?
+                                 WHERE hash=? AND extractor=?""",
+                                 (time.time(), digest, extractor))
+        return json.loads(row[0]) if row else None
+
+    def put_record(self, digest, extractor, version, record):
+        """Keeps the record extracted from the page content with hash
+        `digest`. It replaces the one of an older extractor version.
+        """
+        data = json.dumps(record)
+        with self.lock:
+            conn = self._db()
+            with conn:
+                # An upsert, since REPLACE would not run the delete
+                # trigger keeping stored_bytes
+                conn.execute(
+                    """INSERT INTO records(hash, extractor, version, data,
+                    accessed_at) VALUES (?,?,?,?,?)
+                    ON CONFLICT(hash, extractor) DO UPDATE SET
+                    version=excluded.version, data=excluded.data,
+                    accessed_at=excluded.accessed_at""",
+                    (digest, extractor, version, data, time.time()))
+            evict = self._evict_due(conn)
+        if evict:
+            self.evict()
+
+    def get_validators(self, url):
+        """Returns the (etag, last_modified) stored for `url`, fresh or
+        expired, or None when there are none.
+        """
+        with self.lock:
+            row = self._db().execute(
+                """SELECT etag, last_modified FROM pages WHERE url=? AND
+                (etag IS NOT NULL OR last_modified IS NOT NULL)""",
+                (url,)).fetchone()
+        return tuple(row) if row else None
+
+    def refresh(self, url):
+        """Marks the page of `url` as fetched now, after the server told
+        that it did not change. Returns its content hash, or None.
+        """
+        now = time.time()
+        with self.lock:
+            conn = self._db()
+            with conn:
+                conn.execute("""UPDATE pages SET fetched_at=?, accessed_at=?
+                             WHERE url=?""", (now, now, url))
+                row = conn.execute("SELECT hash FROM pages WHERE url=?",
+                                   (url,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, url, content, status=200, page_type="page", etag=None,
+            last_modified=None):
+        """Stores the page content for `url` along with its validators.
+        Returns the content hash.
+        """
+        raw = content.encode("utf8") if isinstance(content, str) else content
+        digest = hashlib.sha256(raw).hexdigest()
+        data = zlib.compress(raw, self.compress_level)
+        now = time.time()
+        with self.lock:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    """INSERT OR IGNORE INTO blobs(hash, size, data)
+                    VALUES (?,?,?)""", (digest, len(raw), data))
+                old = conn.execute("SELECT hash FROM pages WHERE url=?",
+                                   (url,)).fetchone()
+                conn.execute(
+                    """INSERT OR REPLACE INTO pages(url, hash, fetched_at,
+                    status, page_type, accessed_at, etag, last_modified)
+                    VALUES (?,?,?,?,?,?,?,?)""",
+                    (url, digest, now, status, page_type, now, etag,
+                     last_modified))
+                if old and old[0] != digest:
+                    self._drop_orphans(conn, [old[0]])
+            evict = self._evict_due(conn)
+        if evict:
+            self.evict()
+        return digest
+
+    def _evict_due(self, conn):
+        """Counts a store and tells whether eviction should run. Each job
+        has its own PageCache, so a count alone would let the jobs which
+        store fewer than EVICT_EVERY pages never evict.
+        """
+        self.puts += 1
+        if (self.puts - 1) % EVICT_EVERY == 0:
+            return True
+        return bool(self.max_bytes) and conn.execute(
+            "SELECT val FROM meta WHERE key='stored_bytes'").fetchone()[0] \
+            > self.max_bytes
+
+    def stored_bytes(self):
+        with self.lock:
+            return self._db().execute(
+                "SELECT val FROM meta WHERE key='stored_bytes'").fetchone()[0]
+
+    def _drop_orphans(self, conn, hashes):
+        params = [(h,) for h in hashes]
+        conn.executemany(
+            """DELETE FROM blobs WHERE hash=? AND NOT EXISTS
+            (SELECT 1 FROM pages WHERE pages.hash=blobs.hash)""", params)
+        conn.executemany(
+            """DELETE FROM records WHERE hash=? AND NOT EXISTS
+            (SELECT 1 FROM blobs WHERE blobs.hash=records.hash)""", params)
+
+    def _delete_pages(self, conn, rows):
+        conn.executemany("DELETE FROM pages WHERE url=?",
+                         [(r[0],) for r in rows])
+        self._drop_orphans(conn, set(r[1] for r in rows))
+
+    def _delete_records(self, conn, rows):
+        conn.executemany("DELETE FROM records WHERE hash=? AND extractor=?",
+                         rows)
+
+    def evict(self):
+        """Removes the expired pages which cannot be revalidated and the
+        ones too stale to be revalidated, and the records without a page
+        unused for their TTL. Then removes the least recently used pages
+        and records until the store fits in max_bytes.
+        Returns the number of pages and records removed.
+        """
+        removed = 0
+        now = time.time()
+        with self.lock:
+            conn = self._db()
+            with conn:
+                types = [r[0] for r in conn.execute(
+                    "SELECT DISTINCT page_type FROM pages")]
+                for page_type in types:
+                    ttl = self._ttl(page_type)
+                    rows = conn.execute(
+                        """SELECT url, hash FROM pages
+                        WHERE page_type=? AND (fetched_at<? OR (fetched_at<?
+                        AND etag IS NULL AND last_modified IS NULL))""",
+                        (page_type, now - ttl * self.stale_factor,
+                         now - ttl)).fetchall()
+                    self._delete_pages(conn, rows)
+                    removed += len(rows)
+                rows = conn.execute(
+                    """SELECT hash, extractor FROM records r
+                    WHERE accessed_at<? AND NOT EXISTS
+                    (SELECT 1 FROM blobs b WHERE b.hash=r.hash)""",
+                    (now - self._ttl("record"),)).fetchall()
+                self._delete_records(conn, rows)
+                removed += len(rows)
+
+            while self.max_bytes:
+                stored = conn.execute(
+                    "SELECT val FROM meta WHERE key='stored_bytes'").fetchone()[0]
+                excess = stored - self.max_bytes
+                if excess <= 0:
+                    break
+                with conn:
+                    pages, records = [], []
+                    for kind, key, digest, size, _ in conn.execute(
+                            """SELECT 'page', p.url, p.hash, LENGTH(b.data),
+                            p.accessed_at FROM pages p
+                            JOIN blobs b ON b.hash=p.hash
+                            UNION ALL
+                            SELECT 'record', r.extractor, r.hash,
+                            LENGTH(r.data), r.accessed_at FROM records r
+                            WHERE NOT EXISTS
+                            (SELECT 1 FROM blobs b WHERE b.hash=r.hash)
+                            ORDER BY 5 LIMIT ?""", (EVICT_BATCH,)):
+                        if kind == "page":
+                            pages.append((key, digest))
+                        else:
+                            records.append((digest, key))
+                        excess -= size
+                        if excess <= 0:
+                            break
+                    if not pages and not records:
+                        break
+                    self._delete_pages(conn, pages)
+                    self._delete_records(conn, records)
+                    removed += len(pages) + len(records)
+            if removed:
+                # Run as a script: execute() steps the pragma once, which
+                # frees a single page
+                conn.executescript("PRAGMA incremental_vacuum;")
+        return removed
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
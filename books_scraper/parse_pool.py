@@ -0,0 +1,93 @@
+"""
+Process pool for the CPU bound part of scraping: parsing the pages.
+The raw HTML is sent to the worker processes and the extracted records
+are sent back, so that parsing is not limited to one core by the GIL.
+Results are always handed back in the order the pages were submitted,
+and whatever writes them stays in the calling process.
+"""
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# Items in flight per worker when streaming, see ParsePool.stream
+WINDOW_PER_WORKER = 4
+
+
+class ParsePool(object):
+    """Runs parse functions in `workers` processes, started on first use.
+    The functions must be module level and their arguments picklable.
+    With a single worker the functions run in the calling thread, as
+    before there was a pool. `initializer(*initargs)` is run in each
+    worker process when it starts, e.g. to set up the logging there.
+    """
+
+    def __init__(self, workers=1, initializer=None, initargs=()):
+        self.workers = max(1, int(workers or 1))
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        with self.lock:
+            if self.pool is None:
+                # Forked workers could inherit locks held by the fetch
+                # threads of the scraper, hence fresh interpreters.
+                ctx = multiprocessing.get_context("spawn")
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=ctx,
+                                                initializer=self.initializer,
+                                                initargs=self.initargs)
+            return self.pool
+
+    def submit(self, fn, *args, **kwargs):
+        """Returns a Future for the result of fn(*args, **kwargs)."""
+        if self.workers > 1:
+            return self._executor().submit(fn, *args, **kwargs)
+        fut = Future()
+        try:
+            fut.set_result(fn(*args, **kwargs))
+        except Exception as ex:
+            fut.set_exception(ex)
+        return fut
+
+    def parse(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in a worker and returns its result.
+        Safe to call from several threads at once.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def map(self, fn, items, chunksize=1):
+        """Yields fn(item) for each of the items, in order."""
+        if self.workers > 1:
+            return self._executor().map(fn, items, chunksize=chunksize)
+        return map(fn, items)
+
+    def stream(self, fn, items, window=None, known=None):
+        """Yields (item, Future for fn(item)) for each of the items, in
+        order. At most `window` items are in flight, so that a lazy
+        `items` is read only as fast as it is parsed and memory use stays
+        flat. `known(item)` may return the result of an item without it
+        being parsed, or None.
+        """
+        window = window or WINDOW_PER_WORKER * self.workers
+        pending = collections.deque()
+        for item in items:
+            res = known(item) if known else None
+            if res is None:
+                fut = self.submit(fn, item)
+            else:
+                fut = Future()
+                fut.set_result(res)
+            pending.append((item, fut))
+            if len(pending) >= window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
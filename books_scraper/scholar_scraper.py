@@ -3,27 +3,30 @@ Written with a lot of help from StackOverflow community
 and Python API documentation. Greatly appreciated!
 """
 import os
+import sys
 import glob
 import math
 import csv
 import re
 import lxml
-import time
 import requests
-import random
 import traceback
 import argparse
 import urllib3
 from pathlib import Path
 from bs4 import BeautifulSoup
 from datetime import datetime as DT
-from selenium import webdriver
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from getpass import getpass
 from selenium.webdriver.common.keys import Keys
 from zipfile import ZipFile
+# Allows importing from: ../../
+parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent)
+from books_scraper.driver_pool import new_driver
+from books_scraper.http_client import configure_pacing
 
 # Disable the SSL warnings
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -60,9 +63,16 @@ def try_get_item(soup, sel):
 class GSScraper(object):
     def __init__(self, query, web_browser="firefox", max_recs=10,
                  out_dir="output", timeout=10,
-                 scholar_id=None, scholar_password=None):
+                 scholar_id=None, scholar_password=None, lean_browser=False,
+                 pages_per_sec=None, pacing_jitter=0.5):
         self.timeout = timeout
         self.web_browser = web_browser
+        # Skip the images, fonts, media and trackers of the pages
+        self.lean_browser = lean_browser
+        # Page loads are paced per source by the policy shared by the
+        # jobs of the process, apart from waiting for the pages to be ready
+        self.pacing = configure_pacing(pages_per_sec, jitter=pacing_jitter,
+                                       log=log)
         self.max_recs = int(max_recs)
         self.query = query
         self.scholar_id = scholar_id
@@ -72,28 +82,13 @@ class GSScraper(object):
 
     def _init_selinium(self):
         log("Initializing webdriver for "+self.web_browser)
-        if "chrome" == self.web_browser:
-            self.browser = webdriver.Chrome()
-        elif "firefox" == self.web_browser:
-            from selenium.webdriver.firefox.options import Options
-            opt = Options()
-            opt.headless = True
-            self.browser = webdriver.Firefox(options=opt)
-        elif "safari" == self.web_browser:
-            self.browser = webdriver.Safari()
-        elif "edge" == self.web_browser:
-            self.browser = webdriver.Edge()
-        else:
-            raise Exception("Unsupported browser: "+self.web_browser)
-
+        self.browser = new_driver(self.web_browser, lean=self.lean_browser)
         self.web_wait = WebDriverWait(self.browser, self.timeout)
 
     def _web_wait(self, by, val):
+        """Waits until the loaded page has the element (by, val)."""
         self.web_wait.until(
             EC.presence_of_element_located((by, val)))
-        wtime = random.randrange(3, 10)
-        log("Waiting for {0}s".format(wtime))
-        time.sleep(wtime)
 
     def _extract_gs_data(self, html):
         soup = BeautifulSoup(html, "lxml")
@@ -121,22 +116,22 @@ class GSScraper(object):
         try:
             if self.scholar_id and self.scholar_password:
                 log("Logging in to Google Scholar.")
+                self.pacing.wait("scholar")
                 self.browser.get(
                     "https://accounts.google.com/Login?hl=en&continue=https://scholar.google.com/")
                 self._web_wait(By.ID, 'identifierId')
-                user_id = self.browser.find_element_by_id(
-                    "identifierId")
+                user_id = self.browser.find_element(By.ID, "identifierId")
                 user_id.clear()
                 user_id.send_keys(self.scholar_id)
+                self.pacing.wait("scholar")
                 user_id.send_keys(Keys.RETURN)
                 log("Sent the user ID to server.")
                 self._web_wait(By.NAME, 'password')
-                passw = self.browser.find_element_by_name(
-                    "password")
+                passw = self.browser.find_element(By.NAME, "password")
                 log("Found password input box.")
                 passw.send_keys(self.scholar_password)
-                time.sleep(4)
-                self.browser.find_element_by_id("passwordNext").click()
+                self.pacing.wait("scholar")
+                self.browser.find_element(By.ID, "passwordNext").click()
                 log("Sent the credentials to server.")
             else:
                 log("Using Google Scholar without logging in.")
@@ -145,34 +140,31 @@ class GSScraper(object):
             log("Will attempt using Google Scholar without logging in.")
 
         pg_url = "https://scholar.google.com"
+        self.pacing.wait("scholar")
         self.browser.get(pg_url)
         self._web_wait(By.ID, 'gs_hdr_tsi')
         log("Loaded Google Scholar page.")
-        query = self.browser.find_element_by_id("gs_hdr_tsi")
+        query = self.browser.find_element(By.ID, "gs_hdr_tsi")
         query.clear()
         query.send_keys(query_str)
+        self.pacing.wait("scholar")
         query.send_keys(Keys.RETURN)
-        # self.browser.find_element_by_id("gs_hdr_tsb").click()
+        # self.browser.find_element(By.ID, "gs_hdr_tsb").click()
         log("Sent search query to website.")
         self._web_wait(By.CLASS_NAME, 'gs_ab_mdw')
         has_next = True
-        page_count = 0
         while has_next:
-            # Throttle the crawling regularly at random interval
-            if page_count >= random.randrange(5, 10):
-                ptt = random.randrange(6, 16)
-                time.sleep(ptt)
-                log("Throttling down the paginator by {0}s".format(ptt))
-                page_count = 0
-            else:
-                time.sleep(random.randrange(3, 7))
             yield self.browser.page_source
-            page_count += 1
             try:
-                nb = self.browser.find_element_by_link_text("Next")
-                if nb:
+                # The last page has no Next link
+                nbs = self.browser.find_elements(By.LINK_TEXT, "Next")
+                if nbs:
+                    nb = nbs[0]
                     log("Going to next page...")
+                    self.pacing.wait("scholar")
                     nb.click()
+                    # The current page still has the element waited for
+                    self.web_wait.until(EC.staleness_of(nb))
                     self._web_wait(
                         By.CLASS_NAME, 'gs_ico_nav_next')
                 else:
@@ -180,6 +172,8 @@ class GSScraper(object):
             except Exception as ex:
                 traceback.print_exc()
                 log("Error when paginating to next. "+str(ex))
+                # Going on would yield the same page again
+                has_next = False
 
     def screape_google_scholar_paged(self):
         try:
@@ -194,7 +188,7 @@ class GSScraper(object):
                     recs = 0
                     while recs < self.max_recs:
                         try:
-                            gsr_html = next(pager)
+                            gsr_html = next(pager, None)
                             log("Fetched {0}/{1} results.".format(recs, self.max_recs))
                             if not gsr_html:
                                 break
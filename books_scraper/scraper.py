@@ -5,40 +5,75 @@ and Python API documentation. Greatly appreciated!
 import os
 import glob
 import math
+import json
 import csv
 import re
 import lxml
 import time
-import requests
-import random
+import hashlib
+import inspect
+import threading
 import traceback
-import urllib3
+from lxml import etree
 from pathlib import Path
 from bs4 import BeautifulSoup
 from datetime import datetime as DT
-from fake_useragent import UserAgent
-from selenium import webdriver
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
 from getpass import getpass
-from selenium.webdriver.common.keys import Keys
 from zipfile import ZipFile
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from books_scraper.http_client import AdaptiveRateLimiter, rate_from_delay
+from books_scraper.http_client import configure_session, timed_get
+from books_scraper.http_client import CircuitBreaker, RetryPolicy, FetchError
+from books_scraper.http_client import get_with_retry, RETRY_STATUSES
+from books_scraper.http_client import conditional_headers, cookie_jar
+from books_scraper.http_client import make_session
+from books_scraper.http_client import configure_pacing
+from books_scraper.http_client import USER_AGENTS as UA
+from books_scraper.page_cache import PageCache
+from books_scraper.parse_pool import ParsePool
+from books_scraper.driver_pool import get_driver_pool, cookie_file
+from books_scraper.driver_pool import load_cookies, save_cookies
+from books_scraper.sinks import CsvSink, SqliteSink, TeeSink, csv_to_parquet
+from books_scraper import lxml_engine as LX
+from books_scraper import html2csv
 
-# Disable the SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-UA = UserAgent()
 FIXED_UA = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.14; rv:74.0) Gecko/20100101 Firefox/74.0"
 DEBUG = False
 LOG_FILE = None
+_LOG_LOCAL = threading.local()
 HTTP_TIMEOUT_SEC = 5
 HTTP_DELAY_SEC = 2
+GR_HOME_URL = "https://www.goodreads.com/"
+GR_LOGIN_URL = "https://www.goodreads.com/user/sign_in"
 ROW_KEYS = ['author', 'title', 'language', 'genre', 'avg_rating',
             'ratings', 'reviews', 'book_format', 'pages',
             'isbn', 'pub_year', 'publisher', 'url', 'synopsis']
 GS_ROW_KEYS = ["author", "title", "publication", "citedby", "url", "abstract"]
 NDL_ROW_KEYS = ["author", "title", "language", "url", "abstract"]
+# Name of the Goodreads book page extractor in the record cache
+BOOK_EXTRACTOR = "goodreads_book"
+# Extractors available for Goodreads book pages
+PARSER_ENGINES = ["lxml", "bs4"]
+# XPath equivalents of the soup.find() lookups of the book page extractor
+GR_DETAILS_XP = etree.XPath(
+    "descendant::div[@id='details'][normalize-space(@class)='uitext darkGreyText']")
+GR_FORMAT_XP = etree.XPath("descendant::span[@itemprop='bookFormat']")
+GR_PAGES_XP = etree.XPath("descendant::span[@itemprop='numberOfPages']")
+GR_LANG_XP = etree.XPath("descendant::div[@itemprop='inLanguage']")
+# Parts of the Goodreads pages read by the extractors, see partial_parse
+GR_BOOK_REGIONS = ["#bookTitle", "#bookAuthors", "#bookMeta", "#details",
+                   "#description"]
+GR_SHELF_REGIONS = [".leftContainer"]
+# Page kinds which can be extracted from an uploaded ZIP file, with
+# their selector files
+ZIP_SOURCES = {"NDL": "ndl", "GS": "gs", "AZ": "amazon_search",
+               "AZB": "amazon_book", "LOC": "loc"}
+# The CSV of a ZIP file is synced to disk and its progress saved after
+# this many entries, see extract_from_zip
+ZIP_CHECKPOINT_EVERY = 50
+ZIP_CSV = "local_cs.csv"
+ZIP_CHECKPOINT = "local_cs.ckpt"
 
 
 class Obj:
@@ -50,13 +85,28 @@ class Obj:
 def log(msg):
     ts = DT.now().strftime("%Y-%m-%d@%I:%M:%S%p")
     msg_str = "[{0}] : {1}".format(ts, msg)
-    if not LOG_FILE:
+    log_file = get_log_file()
+    if not log_file:
         print(msg_str, flush=True)
     else:
-        with open(LOG_FILE, "a") as fp:
+        with open(log_file, "a") as fp:
             print(msg_str, file=fp, flush=True)
 
 
+def set_log_file(path):
+    """Sends the log of the calling thread to `path`, or to LOG_FILE when
+    None. Jobs sharing a process (e.g. in the web app) each log to their
+    own file this way. Also runs in the fetch threads and parse workers
+    of a scraper, so that their log reaches the task log.
+    """
+    _LOG_LOCAL.path = path
+
+
+def get_log_file():
+    """The file the calling thread logs to, None for stdout."""
+    return getattr(_LOG_LOCAL, "path", None) or LOG_FILE
+
+
 def debug(msg):
     if DEBUG:
         log(msg)
@@ -71,12 +121,59 @@ def overwrite_existing_path(path_str, options=None):
     return fo
 
 
-def make_http_request(url, timeout=10, http_delay_sec=4):
+def make_http_request(url, timeout=10, http_delay_sec=4, rate_limiter=None,
+                      retry_policy=None, breaker=None, headers=None,
+                      session=None):
+    hdrs = {'User-Agent': UA.random}
+    hdrs.update(headers or {})
+    if rate_limiter or retry_policy or breaker:
+        return get_with_retry(url, rate_limiter=rate_limiter,
+                              retry_policy=retry_policy, breaker=breaker,
+                              log=log, headers=hdrs, timeout=timeout,
+                              session=session)
     log("Requesting URL {0}. Delay {1}s".format(url, http_delay_sec))
     time.sleep(http_delay_sec)
-    return requests.get(url,
-                        headers={'User-Agent': UA.random},
-                        timeout=timeout)
+    return timed_get(url, headers=hdrs, timeout=timeout, session=session)
+
+
+def code_version(*funcs):
+    """Fingerprint of the source code of the given functions. It changes
+    whenever one of them is edited.
+    """
+    md = hashlib.sha1()
+    for fn in funcs:
+        try:
+            md.update(inspect.getsource(fn).encode("utf8"))
+        except (OSError, TypeError):
+            # No source, e.g. an install of .pyc files only; a module
+            # has no __qualname__
+            name = getattr(fn, "__qualname__", getattr(fn, "__name__",
+                                                       repr(fn)))
+            md.update(name.encode("utf8"))
+    return md.hexdigest()[:16]
+
+
+def file_digest(path):
+    """SHA-256 of the content of a file."""
+    md = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            md.update(chunk)
+    return md.hexdigest()
+
+
+def read_zip_checkpoint(out_dir):
+    """Returns the progress saved by an interrupted ZIP extraction into
+    out_dir (see BookScraper.extract_from_zip), or None.
+    """
+    ckpt_file = os.path.join(out_dir, ZIP_CHECKPOINT)
+    if not os.path.isfile(ckpt_file):
+        return None
+    try:
+        with open(ckpt_file) as fp:
+            return json.load(fp)
+    except ValueError:
+        return None
 
 
 def try_get_item(soup, sel):
@@ -89,222 +186,402 @@ def try_get_item(soup, sel):
 
 
 class BookScraper(object):
+    # Source fingerprint of the book page extractor, see code_version
+    _book_version = None
+
     def __init__(self, query, web_browser="firefox", max_recs=10, html_dir=None,
                  use_cached_books=True, gr_login=None,
-                 gr_password=None, out_dir="output", timeout=10, http_delay_sec=2):
+                 gr_password=None, out_dir="output", timeout=10, http_delay_sec=2,
+                 fetch_workers=1, req_per_sec=None, max_req_per_sec=None,
+                 http_pool_size=None, max_retries=3, breaker_failures=5,
+                 breaker_reset_sec=60, ua_file=None, cache_max_mb=None,
+                 cache_ttl_days=None, parser_engine="lxml",
+                 partial_parse=True, parse_workers=1, parquet_output=False,
+                 records_db=None, driver_pool_size=1, http_shelves=False,
+                 lean_browser=False, pages_per_sec=None, pacing_jitter=0.5,
+                 log_file=None):
+        # The log of the thread running the scraper and of its workers
+        # goes to log_file, when set
+        if log_file:
+            set_log_file(log_file)
+        self.log_file = get_log_file()
         self.timeout = timeout
         self.http_delay_sec = http_delay_sec
+        # Book pages are fetched by a pool of workers whose combined
+        # request rate per host is set by the token bucket limiter. The
+        # rate starts at req_per_sec and adapts to the server responses
+        # up to max_req_per_sec.
+        self.fetch_workers = max(1, int(fetch_workers))
+        self.req_per_sec = float(req_per_sec) if req_per_sec \
+            else rate_from_delay(http_delay_sec)
+        self.rate_limiter = AdaptiveRateLimiter(
+            self.req_per_sec,
+            max_rate=float(max_req_per_sec) if max_req_per_sec else None,
+            log=log)
+        if http_pool_size:
+            configure_session(int(http_pool_size))
+        # Book pages which could not be fetched are queued as
+        # (genre, url) for another pass instead of being written blank.
+        self.retry_policy = RetryPolicy(max_retries=max_retries)
+        self.breaker = CircuitBreaker(max_failures=breaker_failures,
+                                      reset_sec=breaker_reset_sec)
+        self.retry_queue = []
+        # Page loads are paced per source by the policy shared by the
+        # jobs of the process, apart from waiting for the pages to be ready
+        self.pacing = configure_pacing(pages_per_sec, jitter=pacing_jitter,
+                                       log=log)
+        if ua_file:
+            UA.configure(ua_file)
         self.web_browser = web_browser
+        # Browsers are leased from a pool of at most driver_pool_size,
+        # shared by the crawls of this process
+        self.driver_pool_size = driver_pool_size
         self.max_recs = int(max_recs)
         self.query = query
         self.html_dir = html_dir
         ucb = str(use_cached_books).lower().strip()
         tv = ["true", "t", "1", "yes", "on", "y"]
         self.use_cached_books = ucb in tv
+        # Shelf pages are fetched over HTTP with the session cookies of
+        # the browser login, instead of being loaded in the browser
+        self.http_shelves = str(http_shelves).lower().strip() in tv
+        # Browsers skip the images, fonts, media and trackers of the pages
+        self.lean_browser = str(lean_browser).lower().strip() in tv
         Path(self.html_dir).mkdir(parents=True, exist_ok=True)
+        if parser_engine not in PARSER_ENGINES:
+            raise Exception("Unsupported parser engine: "+str(parser_engine))
+        self.parser_engine = parser_engine
+        # Only the regions of the Goodreads pages which are read are
+        # parsed, instead of the whole page.
+        self.partial_parse = str(partial_parse).lower().strip() in tv
+        # Pages are parsed by a pool of parse_workers processes
+        self.parse_pool = ParsePool(parse_workers, initializer=set_log_file,
+                                    initargs=(self.log_file,))
+        # Each CSV output is also written as a typed Parquet file
+        self.parquet_output = str(parquet_output).lower().strip() in tv
+        # The records are also upserted into this SQLite database, shared
+        # by the runs, when set
+        self.records_db = records_db
+        self.page_cache = PageCache(
+            self.html_dir,
+            max_bytes=int(float(cache_max_mb) * 1024 * 1024)
+            if cache_max_mb else None,
+            ttl_sec=dict((k, float(v) * 24 * 3600)
+                         for k, v in (cache_ttl_days or {}).items()))
         self.gr_login = gr_login
         self.gr_password = gr_password
         self.out_dir = out_dir
         Path(self.out_dir).mkdir(parents=True, exist_ok=True)
         log("Using cached books: "+str(self.use_cached_books) +
-            ". Timeout = "+str(self.timeout))
-
-    def _init_selinium(self):
-        log("Initializing webdriver for "+self.web_browser)
-        if "chrome" == self.web_browser:
-            self.browser = webdriver.Chrome()
-        elif "firefox" == self.web_browser:
-            from selenium.webdriver.firefox.options import Options
-            opt = Options()
-            opt.headless = True
-            self.browser = webdriver.Firefox(options=opt)
-        elif "safari" == self.web_browser:
-            self.browser = webdriver.Safari()
-        elif "edge" == self.web_browser:
-            self.browser = webdriver.Edge()
-        else:
-            raise Exception("Unsupported browser: "+self.web_browser)
-
+            ". Timeout = "+str(self.timeout) +
+            ". Fetch workers = "+str(self.fetch_workers) +
+            ". Parse workers = "+str(self.parse_pool.workers) +
+            ". Requests/sec = "+str(self.req_per_sec))
+
+    def _init_selinium(self, pd):
+        from selenium.webdriver.support.ui import WebDriverWait
+        self.browser = pd.browser
         self.web_wait = WebDriverWait(self.browser, self.timeout)
 
     def _web_wait(self, by, val):
+        """Waits until the loaded page has the element (by, val)."""
+        from selenium.webdriver.support import expected_conditions as EC
         self.web_wait.until(
             EC.presence_of_element_located((by, val)))
-        wtime = random.randrange(3, 10)
-        log("Waiting for {0}s".format(wtime))
-        time.sleep(wtime)
 
-    def _crawl_goodreads_shelves(self):
-        crawled_files = {}
-        self._init_selinium()
-        login_url = "https://www.goodreads.com/user/sign_in"
-        self.browser.get(login_url)
-        log("Loaded login page.")
-        username = self.browser.find_element_by_id("user_email")
-        password = self.browser.find_element_by_id("user_password")
-        username.send_keys(self.gr_login)
-        password.send_keys(self.gr_password)
-        self.browser.find_element_by_name("sign_in").submit()
-        log("Sent login request to website.")
-        try:
-            self._web_wait(By.CLASS_NAME, 'siteHeader__personal')
-            log("Loaded the user home page.")
-        except Exception:
-            log("Failed to login.")
-            raise
-
-        if "Recent updates" in self.browser.title:
-            shelf_url = "https://www.goodreads.com/shelf/show/{0}?page={1}"
-            for gn in self.query.split(","):
-                gn = gn.strip()
-                crawled_files[gn] = []
-                no_of_shelves = math.ceil(int(self.max_recs)/50) + 1
-                for p in range(1, no_of_shelves):
-                    html_file = "shelf_{0}_p{1}.html".format(gn, p)
-                    crawled_files[gn].append(html_file)
-                    url = shelf_url.format(gn, p)
-                    if self.use_cached_books and self._is_cached(html_file):
-                        log("Page {0} already downloaded. Skipping to next.".format(
-                            url))
-                        continue
-
-                    time.sleep(2)
-                    log("Fetching ["+url+"]")
-                    self.browser.get(url)
-                    html_source = self.browser.page_source
-                    self._cache_page(html_file, html_source)
-
-            log("Closing the browser")
-            self.browser.close()
+    def _browser_get(self, url):
+        self.pacing.wait("goodreads")
+        self.browser.get(url)
+
+    def _goodreads_logged_in(self):
+        from selenium.webdriver.common.by import By
+        self._browser_get(GR_HOME_URL)
+        return len(self.browser.find_elements(
+            By.CLASS_NAME, 'siteHeader__personal')) > 0
+
+    def _goodreads_login(self, pd):
+        """Logs the leased browser in to Goodreads, unless it still is
+        from an earlier crawl. A login seen recently is not checked again.
+        The saved session cookies are tried before the login form.
+        """
+        from selenium.webdriver.common.by import By
+        if pd.login_checked(self.gr_login):
+            log("Browser was logged in recently.")
+            return
+        if pd.login == self.gr_login and self._goodreads_logged_in():
+            log("Browser is already logged in.")
+            pd.checked_at = time.time()
+            return
+        pd.login = None
+        self._browser_get(GR_HOME_URL)
+        self.browser.delete_all_cookies()
+        ck_file = cookie_file(self.html_dir, self.gr_login)
+        if load_cookies(self.browser, ck_file) and self._goodreads_logged_in():
+            log("Logged in with the saved session cookies.")
         else:
-            raise Exception("Failed to load the landing page.")
-        return crawled_files
-
-    def _is_cached(self, file_name):
-        file_path = "{0}/{1}".format(self.html_dir, file_name)
-        return os.path.exists(file_path)
-
-    def _cache_page(self, file_name, page_content):
-        file_path = "{0}/{1}".format(self.html_dir, file_name)
-        with open(file_path, "w") as html:
-            html.write(page_content)
-            log("Saved HTML at: "+file_path)
+            self.browser.delete_all_cookies()
+            self._browser_get(GR_LOGIN_URL)
+            log("Loaded login page.")
+            username = self.browser.find_element(By.ID, "user_email")
+            password = self.browser.find_element(By.ID, "user_password")
+            username.send_keys(self.gr_login)
+            password.send_keys(self.gr_password)
+            self.pacing.wait("goodreads")
+            self.browser.find_element(By.NAME, "sign_in").submit()
+            log("Sent login request to website.")
+            try:
+                self._web_wait(By.CLASS_NAME, 'siteHeader__personal')
+                log("Loaded the user home page.")
+            except Exception:
+                log("Failed to login.")
+                raise
+            if "Recent updates" not in self.browser.title:
+                raise Exception("Failed to load the landing page.")
+        pd.login = self.gr_login
+        pd.checked_at = time.time()
+        save_cookies(self.browser, ck_file)
 
-    def _get_cache_page(self, file_name):
-        file_path = "{0}/{1}".format(self.html_dir, file_name)
-        with open(file_path, "r") as html:
-            return html.read()
+    def _crawl_goodreads_shelves(self):
+        pool = get_driver_pool(self.web_browser, self.driver_pool_size,
+                               log=log, lean=self.lean_browser)
+        sess = None
+        with pool.lease() as pd:
+            self._init_selinium(pd)
+            self._goodreads_login(pd)
+            if self.http_shelves:
+                # The browser is only needed for the login: the shelves
+                # are fetched over HTTP with its session cookies and
+                # User-Agent, through a session of this crawl, so that
+                # the account cookies never reach the shared session.
+                ua = self.browser.execute_script("return navigator.userAgent")
+                sess = make_session(1)
+                sess.cookies = cookie_jar(self.browser.get_cookies())
+            else:
+                crawled_files = self._crawl_shelves(self._get_shelf_browser)
+            log("Returning the browser to the pool")
+        self.browser = None
+        if sess:
+            with sess:
+                crawled_files = self._crawl_shelves(
+                    partial(self._get_shelf_http, sess, {"User-Agent": ua}))
+        return crawled_files
 
-    def _get_pub_date(self, dt_str):
-        pub_dt = '--'
-        pub = '--'
-        try:
-            s = dt_str.strip()
-            bi = s.find(" by ")
-            if s.startswith("Published") and bi > 0:
-                pub_dt = s[9:bi].strip()
-                pub = s[bi+4:].strip()
+    def _crawl_shelves(self, get_shelf):
+        """Stores the shelf pages of the queried genres, fetched with
+        get_shelf(url). Returns the shelf URLs of each genre.
+        """
+        crawled_files = {}
+        shelf_url = "https://www.goodreads.com/shelf/show/{0}?page={1}"
+        for gn in self.query.split(","):
+            gn = gn.strip()
+            crawled_files[gn] = []
+            no_of_shelves = math.ceil(int(self.max_recs)/50) + 1
+            for p in range(1, no_of_shelves):
+                html_file = "shelf_{0}_p{1}.html".format(gn, p)
+                url = shelf_url.format(gn, p)
+                crawled_files[gn].append(url)
+                if self.use_cached_books and self._is_cached(url, html_file, "shelf"):
+                    log("Page {0} already downloaded. Skipping to next.".format(
+                        url))
+                    continue
+                self._cache_page(url, get_shelf(url), page_type="shelf")
+        return crawled_files
 
-        except AttributeError:
-            log("\t**** Could not find publish date.")
-        return pub_dt, pub
+    def _get_shelf_browser(self, url):
+        log("Fetching ["+url+"]")
+        self._browser_get(url)
+        return self.browser.page_source
+
+    def _get_shelf_http(self, sess, headers, url):
+        page = make_http_request(url, timeout=self.timeout,
+                                 http_delay_sec=self.http_delay_sec,
+                                 rate_limiter=self.rate_limiter,
+                                 retry_policy=self.retry_policy,
+                                 breaker=self.breaker,
+                                 headers=headers, session=sess)
+        if page.status_code != 200:
+            raise FetchError(url, page.reason,
+                             retryable=page.status_code in RETRY_STATUSES)
+        if "/user/sign_in" in page.url:
+            raise Exception("The browser session was not accepted for "+url +
+                            ". Set http_shelves off to fetch the shelves "
+                            "with the browser.")
+        return page.content
+
+    def _import_legacy_page(self, url, legacy_file, page_type="page"):
+        """Moves a page saved as a flat file in html_dir by the older
+        versions into the page store. Returns True if there was one.
+        """
+        file_path = os.path.join(self.html_dir, legacy_file or "")
+        if not legacy_file or not os.path.isfile(file_path):
+            return False
+        with open(file_path, "rb") as html:
+            self.page_cache.put(url, html.read(), page_type=page_type)
+        os.remove(file_path)
+        log("Moved {0} to the page store.".format(file_path))
+        return True
+
+    def _is_cached(self, url, legacy_file=None, page_type="page"):
+        return self.page_cache.contains(url) or \
+            self._import_legacy_page(url, legacy_file, page_type)
+
+    def _cache_page(self, url, page_content, page_type="page", etag=None,
+                    last_modified=None):
+        digest = self.page_cache.put(url, page_content, page_type=page_type,
+                                     etag=etag, last_modified=last_modified)
+        log("Saved HTML of {0} as {1}".format(url, digest))
+        return digest
+
+    def _get_cache_page(self, url, legacy_file=None, page_type="page"):
+        """Returns the cached page content of `url` and its hash."""
+        html, digest = self.page_cache.get_with_hash(url)
+        if html is None and self._import_legacy_page(url, legacy_file,
+                                                     page_type):
+            html, digest = self.page_cache.get_with_hash(url)
+        return html, digest
+
+    def _book_extractor_version(self):
+        if not BookScraper._book_version:
+            BookScraper._book_version = code_version(
+                try_get_item, get_pub_date, parse_book_detail,
+                parse_book_detail_lxml, LX.css_to_xpath,
+                LX.parse_html, LX._collect_text, LX.slice_regions,
+                LX._region_start_re, LX._region_end)
+        # The parsed regions change the records as much as the code does
+        regions = GR_BOOK_REGIONS if self.partial_parse else []
+        return BookScraper._book_version + hashlib.sha1(
+            json.dumps(regions).encode("utf8")).hexdigest()[:8]
+
+    def _get_cached_record(self, page_url, url, version):
+        """Returns the book parsed earlier from the same page content,
+        so that the page is not parsed again.
+        """
+        book_info = self.page_cache.get_record(page_url, BOOK_EXTRACTOR,
+                                               version)
+        if book_info is not None:
+            log("Using cached record of "+page_url)
+            if book_info.get("url"):
+                book_info["url"] = url
+        return book_info
 
     def _get_book_detail(self, url):
-        book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
-
         # https://www.goodreads.com/book/show/6708.The_Power_of_Now
-        soup = None
-
-        file_name = "".join(url.split("/"))+".html"
-        if self.use_cached_books and self._is_cached(file_name):
-            log("Using cached file "+file_name)
-            html = self._get_cache_page(file_name)
-            soup = BeautifulSoup(html, "lxml")
+        page_url = "https://www.goodreads.com"+url
+        version = self._book_extractor_version()
+        if self.use_cached_books:
+            book_info = self._get_cached_record(page_url, url, version)
+            if book_info is not None:
+                return book_info
+
+        legacy_file = "".join(url.split("/"))+".html"
+        html, digest = self._get_cache_page(page_url, legacy_file, "book") \
+            if self.use_cached_books else (None, None)
+        if html is not None:
+            log("Using cached page "+page_url)
         else:
-            page_url = "https://www.goodreads.com"+url
+            # An expired (or, without use_cached_books, any) cached copy
+            # is revalidated instead of downloaded again.
+            validators = self.page_cache.get_validators(page_url)
             page = make_http_request(page_url, timeout=self.timeout,
-                                     http_delay_sec=self.http_delay_sec)
-            if page.status_code == requests.codes.ok:
-                self._cache_page(file_name, str(page.content, encoding="utf8"))
-                soup = BeautifulSoup(page.content, 'lxml')
+                                     http_delay_sec=self.http_delay_sec,
+                                     rate_limiter=self.rate_limiter,
+                                     retry_policy=self.retry_policy,
+                                     breaker=self.breaker,
+                                     headers=conditional_headers(validators))
+            if page.status_code == 304 and self.page_cache.refresh(page_url):
+                log("Page not modified: "+page_url)
+                book_info = self._get_cached_record(page_url, url, version)
+                if book_info is not None:
+                    return book_info
+                html, digest = self.page_cache.get_with_hash(page_url)
+            elif page.status_code == 200:
+                digest = self._cache_page(
+                    page_url, page.content, page_type="book",
+                    etag=page.headers.get("ETag"),
+                    last_modified=page.headers.get("Last-Modified"))
+                html = page.content
             else:
-                log("Failed to get page at URL {0}. Error: {1}".format(
-                    page_url, page.reason))
-
-        if not soup:
-            return book_info
-
-        book_info["avg_rating"] = try_get_item(
-            soup, "#bookMeta > span:nth-child(2)")
-        book_info["ratings"] = try_get_item(
-            soup, "a.gr-hyperlink:nth-child(7)")
-        book_info["reviews"] = try_get_item(
-            soup, "a.gr-hyperlink:nth-child(9)")
-        book_info["author"] = try_get_item(
-            soup, "#bookAuthors > span:nth-child(2)")
-        book_info["title"] = try_get_item(soup, "#bookTitle")
-
-        dn = soup.find(
-            "div", {"id": "details", "class": "uitext darkGreyText"})
-        if dn:
-            # dn = soup.find("div#details.uitext.darkGreyText")
-            temp = dn.find("span", {"itemprop": "bookFormat"})
-            book_info["book_format"] = temp.text.strip() if temp else "--"
-            temp = dn.find("span", {"itemprop": "numberOfPages"})
-            book_info["pages"] = temp.text.strip() if temp else "--"
-
-            isbns = dn.select(
-                "div.clearFloats:nth-child(2) > div:nth-child(1)")
-            isbn = "--"
-            try:
-                if isbns and isbns[0].text == "ISBN":
-                    isbn = dn.select(
-                        "div.clearFloats:nth-child(2) > div:nth-child(2)")[0].text
-            except AttributeError:
-                log("\t**** Could not find ISBN.")
-            book_info["isbn"] = isbn.strip()
-
-            temp = dn.find("div", {"itemprop": "inLanguage"})
-            book_info["language"] = temp.text.strip() if temp else "--"
-
-            pub_yr = soup.select("div.row:nth-child(2)")
-
-            pub_dt, pub = self._get_pub_date(
-                pub_yr[0].text) if pub_yr else ("--", "--")
-            book_info["pub_year"] = pub_dt
-            book_info["publisher"] = pub
-
-            book_info["synopsis"] = try_get_item(
-                soup, "div#description.readable.stacked > span:nth-child(2)")
-            book_info["url"] = url
-            return book_info
-        else:
-            return book_info
-
-    def _extract_books_from_shelf(self, genre, writer, soup, books_count):
+                # A 304 for a page evicted meanwhile is fetched again
+                raise FetchError(page_url, page.reason,
+                                 retryable=page.status_code in RETRY_STATUSES
+                                 or page.status_code == 304)
+
+        kind = "GR_BOOK" if self.parser_engine == "lxml" else "GR_BOOK_BS4"
+        book_info = self.parse_pool.parse(
+            parse_page, kind, html, url, partial_parse=self.partial_parse)
+        self.page_cache.put_record(digest, BOOK_EXTRACTOR, version, book_info)
+        return book_info
+
+    def _fetch_book(self, genre, book_url):
+        try:
+            book = {}
+            book["genre"] = genre
+            book.update(self._get_book_detail(book_url))
+            return book
+        except FetchError as ex:
+            log(str(ex))
+            if getattr(ex, "retryable", True):
+                log("Queued {0} for retry.".format(book_url))
+                self.retry_queue.append((genre, book_url))
+            return None
+        except Exception as ex:
+            msg = str(ex)
+            log("Error in getting book info: "+msg+". Continuing.")
+            if DEBUG:
+                traceback.print_exc()
+            return None
+
+    def _extract_books_from_shelf(self, genre, writer, book_urls, books_count):
+        remaining = self.max_recs - books_count.val
+        if remaining <= 0:
+            return
+        book_urls = book_urls[:remaining]
+
+        # The pool only fetches and parses, rows are written here in
+        # the shelf order by the calling thread.
+        with ThreadPoolExecutor(max_workers=self.fetch_workers,
+                                initializer=set_log_file,
+                                initargs=(self.log_file,)) as pool:
+            books = pool.map(lambda u: self._fetch_book(genre, u), book_urls)
+            for book in books:
+                if not book:
+                    continue
+                writer.writerow(book)
+                books_count.val += 1
+                log("Processed {0}/{1} books in {2}.".format(
+                    books_count.val, self.max_recs, genre))
 
-        # Selector for book entries on a shelf page
-        book_entry_sel = ".mainContent .leftContainer .elementList"
-        for n in soup.select(book_entry_sel):
-            try:
-                book = {}
-                book["genre"] = genre
-                book_url = n.find("a", {"class": "bookTitle"})["href"]
-                book.update(self._get_book_detail(book_url))
+    def _retry_failed_books(self, writer, books_count):
+        """Makes another pass over the queued book pages once their host
+        accepts requests again. The ones still failing are listed in a
+        file so that they can be fetched later without a full re-run.
+        """
+        pending, self.retry_queue = self.retry_queue, []
+        for genre, book_url in pending:
+            if books_count.val >= self.max_recs:
+                break
+            page_url = "https://www.goodreads.com"+book_url
+            pause_sec = self.breaker.remaining(page_url)
+            if pause_sec > 0:
+                log("Waiting {0:.0f}s for {1} to be retried.".format(
+                    pause_sec, page_url))
+                time.sleep(pause_sec)
+            book = self._fetch_book(genre, book_url)
+            if book:
                 writer.writerow(book)
-                if books_count.val >= self.max_recs:
-                    break
                 books_count.val += 1
                 log("Processed {0}/{1} books in {2}.".format(
                     books_count.val, self.max_recs, genre))
-            except Exception as ex:
-                msg = str(ex)
-                log("Error in getting book info: "+msg+". Continuing.")
-                if DEBUG:
-                    traceback.print_exc()
-                if "ConnectionResetError" in msg:
-                    log("Waiting for 15s before attempting next request.")
-                    time.sleep(15)
+
+        if self.retry_queue:
+            failed_file = os.path.join(
+                self.out_dir, self.retry_queue[0][0]+"_failed_urls.txt")
+            with open(failed_file, "w") as fp:
+                for genre, book_url in self.retry_queue:
+                    fp.write(book_url+"\n")
+            log("Could not fetch {0} books. Their URLs are in {1}".format(
+                len(self.retry_queue), failed_file))
+            self.retry_queue = []
 
     def scrape_goodreads_books(self):
         try:
@@ -313,245 +590,391 @@ class BookScraper(object):
                 fn = genre+"_GOODREADS.csv"
                 out_file = "{0}/{1}".format(self.out_dir, fn)
 
-                with open(out_file, "w", newline='') as csvfile:
-                    dw = csv.DictWriter(csvfile, ROW_KEYS,
-                                        extrasaction='ignore')
+                with self._open_sink(out_file, ROW_KEYS, "GOODREADS") as dw:
                     dw.writeheader()
-                    csvfile.flush()
-                    shelf_pages = []
-                    for file_name in crawled_files[genre]:
-                        # File name is like: "shelf_{0}_p{1}.html"
-                        shelf_pages.extend(
-                            glob.glob("{0}/{1}".format(self.html_dir, file_name)))
                     bc = Obj()
-                    for h in shelf_pages:
-                        log("Extracting data from {0}".format(h))
-                        # "/parent/path/shelf_{1}_p{2}.html"
-                        gnr = h.split("/")[-1].split("_")[1]
-                        with open(h, 'r') as fp:
-                            soup = BeautifulSoup(fp, 'lxml')
-
+                    shelves = self.parse_pool.map(
+                        partial(parse_page, "GR_SHELF",
+                                partial_parse=self.partial_parse),
+                        self._shelf_pages(crawled_files[genre]))
+                    for book_urls in shelves:
                         self._extract_books_from_shelf(
-                            gnr, dw, soup, books_count=bc)
-                        csvfile.flush()
+                            genre, dw, book_urls, books_count=bc)
+                    self._retry_failed_books(dw, bc)
+                self._write_parquet(out_file)
             log("Scraping complete.")
         except Exception as ex:
             log("Error occurred when crawing: "+str(ex))
             traceback.print_exc()
         except KeyboardInterrupt:
             log("Exiting on user request (pressed Ctrl+C)")
+        finally:
+            self.parse_pool.close()
+
+    def _shelf_pages(self, urls):
+        for url in urls:
+            html, _ = self._get_cache_page(url)
+            if html is None:
+                continue
+            log("Extracting data from {0}".format(url))
+            yield html
+
+    def _zip_extractor_version(self, src_type):
+        return code_version(
+            PAGE_PARSERS[src_type], html2csv,
+            LX.css_to_xpath, LX.parse_html, LX._collect_text) + \
+            html2csv.load_plan(ZIP_SOURCES[src_type]).version
+
+    def _load_zip_checkpoint(self, zip_digest, src_type):
+        """Returns the progress saved by an interrupted extraction of the
+        same ZIP content into out_dir, or None.
+        """
+        ckpt = read_zip_checkpoint(self.out_dir)
+        if ckpt and ckpt["zip"] == zip_digest and \
+                ckpt["src_type"] == src_type and \
+                os.path.isfile(os.path.join(self.out_dir, ZIP_CSV)):
+            return ckpt
+        return None
+
+    def _save_zip_checkpoint(self, ckpt):
+        ckpt_file = os.path.join(self.out_dir, ZIP_CHECKPOINT)
+        with open(ckpt_file+".tmp", "w") as fp:
+            json.dump(ckpt, fp)
+        os.replace(ckpt_file+".tmp", ckpt_file)
 
-    def _extract_gs_data(self, html):
-        soup = BeautifulSoup(html, "lxml")
-        items = soup.select("#gs_res_ccl_mid > div.gs_r.gs_or.gs_scl")
-
-        data = []
-        for obj in items:
-            title = try_get_item(obj, "h3")
-            temp = try_get_item(obj, "div.gs_ri > div.gs_a")
-            authors = temp[:temp.index("-")] if "-" in temp else temp
-            pub = temp[temp.index("-")+1:] if "-" in temp else "--"
-            abst = try_get_item(obj, "div.gs_ri > div.gs_rs")
-            cited_by = try_get_item(obj,
-                                    "div.gs_ri > div.gs_fl > a:nth-child(3)").replace("Cited by ", "")
-            url = obj.select_one("div.gs_ggs.gs_fl > div > div > a")
-            url = url["href"] if url else "--"
-            data.append({"title": title, "author": authors, "publication": pub,
-                         "citedby": cited_by, "url": url, "abstract": abst})
-        return data
-
-    def _get_loc_item(self, txt, key):
-        ival = "--"
+    def extract_from_zip(self, zip_file, src_type):
+        """Writes the records of the HTML pages in the ZIP file to
+        local_cs.csv. Pages seen before (in any ZIP file) are not parsed
+        again: their records are kept in the page store by content hash.
+        Progress is saved every ZIP_CHECKPOINT_EVERY pages, and an extraction
+        interrupted in out_dir resumes from there.
+        """
+        if src_type not in ZIP_SOURCES:
+            raise Exception("Unsupported HTML source: "+str(src_type))
+        csv_path = os.path.join(self.out_dir, ZIP_CSV)
+        zip_digest = file_digest(zip_file)
+        ckpt = self._load_zip_checkpoint(zip_digest, src_type)
+        if ckpt:
+            # Rows written after the last checkpoint are written again
+            with open(csv_path, "r+b") as fp:
+                fp.truncate(ckpt["csv_bytes"])
+            log("Resuming extraction after {0} files.".format(
+                ckpt["entries"]))
+        else:
+            ckpt = {"zip": zip_digest, "src_type": src_type, "entries": 0,
+                    "files": 0, "csv_bytes": 0}
+
+        extractor = "zip_"+src_type
+        version = self._zip_extractor_version(src_type)
+        seen = set()
+
+        def known(entry):
+            data = self.page_cache.get_hash_record(entry[1], extractor,
+                                                   version)
+            if data is not None:
+                seen.add(entry[0])
+            return data
+
+        hdr_keys = []
+        if src_type == "AZ" or src_type == "AZB" or src_type == "LOC" :
+            hdr_keys = ROW_KEYS
+        elif src_type == "GS":
+            hdr_keys = GS_ROW_KEYS
+        else:
+            hdr_keys = NDL_ROW_KEYS
+        with self._open_sink(csv_path, hdr_keys, src_type,
+                             append=ckpt["entries"] > 0) as dw:
+            if not ckpt["entries"]:
+                dw.writeheader()
+            with ZipFile(zip_file) as myzip:
+                zitems = [x for x in myzip.namelist()
+                          if x.endswith(".html")
+                          and "__MACOSX" not in x
+                          and "DS_Store" not in x]
+                log("ZIP file {0} contains {1} items.".format(
+                    zip_file, len(zitems)))
+                ckpt["total"] = len(zitems)
+                self._save_zip_checkpoint(ckpt)
+                # Entries are read as the workers take them and the
+                # records are written here, in the order of the entries.
+                parsed = self.parse_pool.stream(
+                    partial(parse_zip_entry, src_type, self.partial_parse),
+                    self._zip_pages(myzip, zitems, ckpt["entries"]),
+                    known=known)
+                reused = 0
+                try:
+                    for entry, fut in parsed:
+                        try:
+                            data = fut.result()
+                            if entry[0] in seen:
+                                seen.discard(entry[0])
+                                reused += 1
+                            else:
+                                self.page_cache.put_record(
+                                    entry[1], extractor, version, data)
+                            dw.writerows(data)
+                            ckpt["files"] += 1
+                        except Exception as ex:
+                            traceback.print_exc()
+                            log("Error when extracting information from page. "+str(ex))
+                        ckpt["entries"] = entry[0] + 1
+                        if ckpt["entries"] % ZIP_CHECKPOINT_EVERY == 0:
+                            ckpt["csv_bytes"] = dw.flush()
+                            self._save_zip_checkpoint(ckpt)
+                            log("Processed {0}/{1} files.".format(
+                                ckpt["entries"], len(zitems)))
+                finally:
+                    self.parse_pool.close()
+                log("Processed {0}/{1} files, {2} of them seen before.".format(
+                    ckpt["files"], len(zitems), reused))
+        ckpt_file = os.path.join(self.out_dir, ZIP_CHECKPOINT)
+        if os.path.isfile(ckpt_file):
+            os.remove(ckpt_file)
+        self._write_parquet(csv_path)
+
+    def _open_sink(self, csv_path, keys, source, append=False):
+        """Returns the sink of a CSV output, which also writes the records
+        to records_db when it is set. The run is named after out_dir.
+        """
+        csv_sink = CsvSink(csv_path, keys, append=append)
+        if not self.records_db:
+            return csv_sink
+        run = os.path.basename(os.path.abspath(self.out_dir))
+        return TeeSink(csv_sink, SqliteSink(self.records_db, source, run=run))
+
+    def _write_parquet(self, csv_path):
+        if not self.parquet_output:
+            return
         try:
-            ss = [x.strip() for x in txt.split("|")]
-            ival = [x.split(":")[1].strip() 
-                for x in ss if x.startswith(key)][0]
+            log("Saved {0}".format(csv_to_parquet(csv_path)))
         except Exception as ex:
-            pass
-        log("Item value: {0} = {1}".format(key, ival))
-        return ival
-    
-    def _get_loc_books_info(self, html):
-        books = []
-        try:
-            soup = BeautifulSoup(html, "lxml")
-            # Extract book info
-            head = try_get_item(soup, "h1.page-heading")
-            head = head[head.index(":")+1:].strip()
-            genre = self._get_loc_item(head, "SUBJECT")
-            if genre == "--":
-                genre = self._get_loc_item(head, "ALL")
-            lang = self._get_loc_item(head, "Language")
-
-            ul = soup.select("li.search-results-list")
-            for li in ul:
-                try:
-                    book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
-                    book_info["genre"] = genre
-                    book_info["language"] = lang
-                    book_info["book_format"] = try_get_item(li, "div.resultListTextCell div.search-results-list-description-format")
-                    book_info["author"] = try_get_item(li, "div.resultListTextCell div.search-results-list-description-name")
-                    book_info["title"] = try_get_item(li, "div.resultListTextCell div.search-results-list-description-title")
-                    pub = try_get_item(li, "div.resultListTextCell div.search-results-list-description-date")
-                    book_info["publisher"] = pub[:pub.rfind(" ")]
-                    book_info["pub_year"] = pub[pub.rfind(" ")+1:].strip()
-                    books.append(book_info)
-                    log("Book info: {}".format(book_info))
-                except Exception as ex1:
-                    log("Error occurred when extracting book info: {}".format(ex1))
+            log("Error when writing Parquet output: "+str(ex))
+
+    def _zip_pages(self, myzip, zitems, start=0):
+        """Yields (index, content hash, HTML) of the entries from `start`
+        on.
+        """
+        for i in range(start, len(zitems)):
+            zz = zitems[i]
+            try:
+                with myzip.open(zz) as zf:
+                    html = zf.read()
+            except Exception as ex:
+                traceback.print_exc()
+                log("Error when reading ZIP entry {0}. {1}".format(zz, ex))
+                continue
+            debug("Read {0} bytes of ZIP entry {1}".format(len(html), zz))
+            yield i, hashlib.sha256(html).hexdigest(), html
 
-        except Exception as ex:
-            log("Error occurred when fetching extracting books: {}".format(ex))
-        
-        return books
 
-    def _get_amazon_book_info(self, html):
-        book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
+def get_pub_date(dt_str):
+    pub_dt = '--'
+    pub = '--'
+    try:
+        s = dt_str.strip()
+        bi = s.find(" by ")
+        if s.startswith("Published") and bi > 0:
+            pub_dt = s[9:bi].strip()
+            pub = s[bi+4:].strip()
+
+    except AttributeError:
+        log("\t**** Could not find publish date.")
+    return pub_dt, pub
+
+
+def parse_book_detail(html, url, partial_parse=True):
+    book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
+    if partial_parse:
+        html = LX.slice_regions(html, GR_BOOK_REGIONS)
+    soup = BeautifulSoup(html, "lxml")
+
+    book_info["avg_rating"] = try_get_item(
+        soup, "#bookMeta > span:nth-child(2)")
+    book_info["ratings"] = try_get_item(
+        soup, "a.gr-hyperlink:nth-child(7)")
+    book_info["reviews"] = try_get_item(
+        soup, "a.gr-hyperlink:nth-child(9)")
+    book_info["author"] = try_get_item(
+        soup, "#bookAuthors > span:nth-child(2)")
+    book_info["title"] = try_get_item(soup, "#bookTitle")
+
+    dn = soup.find(
+        "div", {"id": "details", "class": "uitext darkGreyText"})
+    if dn:
+        # dn = soup.find("div#details.uitext.darkGreyText")
+        temp = dn.find("span", {"itemprop": "bookFormat"})
+        book_info["book_format"] = temp.text.strip() if temp else "--"
+        temp = dn.find("span", {"itemprop": "numberOfPages"})
+        book_info["pages"] = temp.text.strip() if temp else "--"
+
+        isbns = dn.select(
+            "div.clearFloats:nth-child(2) > div:nth-child(1)")
+        isbn = "--"
         try:
-            soup = BeautifulSoup(html, "lxml")
-            # Extract book info
-            book_info["genre"] = try_get_item(
-                soup, "ul.a-size-small > li:nth-last-child(1)")
-            book_info["synopsis"] = try_get_item(soup, 
-                "#bookDescription_feature_div").replace("\n", "")
-            book_info["title"] = try_get_item(soup, "#title > span")
-            al = soup.select("span.author")
-            authors = []
-            for a in al:
-                authors.append(a.text.strip())
-            book_info["author"] = ", ".join(authors).replace("\n", "")
-            book_info["avg_rating"] = try_get_item(soup, "span.reviewCountTextLinkedHistogram")
-            book_info["ratings"] = try_get_item(soup, "#acrCustomerReviewText")
-            book_info["book_format"] = try_get_item(soup, "#productSubtitle")
-            
-            ul = soup.select(
-                "td.bucket > div:nth-child(2) > ul:nth-child(1) > li")
-            for li in ul:
-                txt = li.text.strip()
-                # print(">>> TEXT={}".format(txt))
-                if txt.startswith("Print Length:"):
-                    book_info["pages"] = txt.split(":")[1].strip()
-                elif txt.startswith("Publisher:"):
-                    book_info["publisher"] = txt.split(":")[1].strip()
-                elif txt.startswith("Publication Date:"):
-                    book_info["pub_year"] = txt.split(":")[1].strip()
-                elif txt.startswith("Language:"):
-                    book_info["language"] = txt.split(":")[1].strip()
-                elif txt.startswith("Format:"):
-                    book_info["book_format"] = txt.split(":")[1].strip()
+            if isbns and isbns[0].text == "ISBN":
+                isbn = dn.select(
+                    "div.clearFloats:nth-child(2) > div:nth-child(2)")[0].text
+        except AttributeError:
+            log("\t**** Could not find ISBN.")
+        book_info["isbn"] = isbn.strip()
 
-        except Exception as ex:
-            log("Error occurred when fetching Amazon book info: {}".format(ex))
-        log("Book info: {}".format(book_info))
-        return [book_info]
+        temp = dn.find("div", {"itemprop": "inLanguage"})
+        book_info["language"] = temp.text.strip() if temp else "--"
 
-    def _extract_amazon_data(self, html):
-        soup = BeautifulSoup(html, "lxml")
-        items = soup.select(
-            "div.s-main-slot.s-result-list > div.s-result-item")
-        print("Records count: {}".format(len(items)))
-        data = []
-        sel_title = "div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > h2:nth-child(1) > a:nth-child(1) > span:nth-child(1)"
+        pub_yr = soup.select("div.row:nth-child(2)")
 
-        sel_auth = "div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > a:nth-child(2)"
+        pub_dt, pub = get_pub_date(
+            pub_yr[0].text) if pub_yr else ("--", "--")
+        book_info["pub_year"] = pub_dt
+        book_info["publisher"] = pub
 
-        sel_url = "div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > h2:nth-child(1) > a:nth-child(1)"
+        book_info["synopsis"] = try_get_item(
+            soup, "div#description.readable.stacked > span:nth-child(2)")
+        book_info["url"] = url
+        return book_info
+    else:
+        return book_info
 
-        sel_book_type = "div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1)"
 
-        sel_rating = "div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(1) > span:nth-child(1)"
+def parse_book_detail_lxml(html, url, partial_parse=True):
+    """Same extraction as parse_book_detail, on an lxml tree with
+    the selectors compiled to XPath.
+    """
+    book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
+    if partial_parse:
+        html = LX.slice_regions(html, GR_BOOK_REGIONS)
+    doc = LX.parse_html(html)
+
+    book_info["avg_rating"] = LX.get_text(
+        doc, "#bookMeta > span:nth-child(2)")
+    book_info["ratings"] = LX.get_text(
+        doc, "a.gr-hyperlink:nth-child(7)")
+    book_info["reviews"] = LX.get_text(
+        doc, "a.gr-hyperlink:nth-child(9)")
+    book_info["author"] = LX.get_text(
+        doc, "#bookAuthors > span:nth-child(2)")
+    book_info["title"] = LX.get_text(doc, "#bookTitle")
+
+    dn = GR_DETAILS_XP(doc)
+    if not dn:
+        return book_info
+    dn = dn[0]
+    temp = GR_FORMAT_XP(dn)
+    book_info["book_format"] = LX.node_text(temp[0]).strip() \
+        if temp else "--"
+    temp = GR_PAGES_XP(dn)
+    book_info["pages"] = LX.node_text(temp[0]).strip() if temp else "--"
+
+    isbns = LX.select(
+        dn, "div.clearFloats:nth-child(2) > div:nth-child(1)")
+    isbn = "--"
+    if isbns and LX.node_text(isbns[0]) == "ISBN":
+        isbn = LX.node_text(LX.select(
+            dn, "div.clearFloats:nth-child(2) > div:nth-child(2)")[0])
+    book_info["isbn"] = isbn.strip()
+
+    temp = GR_LANG_XP(dn)
+    book_info["language"] = LX.node_text(temp[0]).strip() \
+        if temp else "--"
+
+    pub_yr = LX.select_one(doc, "div.row:nth-child(2)")
+    pub_dt, pub = get_pub_date(
+        LX.node_text(pub_yr)) if pub_yr is not None else ("--", "--")
+    book_info["pub_year"] = pub_dt
+    book_info["publisher"] = pub
+
+    book_info["synopsis"] = LX.get_text(
+        doc, "div#description.readable.stacked > span:nth-child(2)")
+    book_info["url"] = url
+    return book_info
+
+
+def get_shelf_book_urls(html, partial_parse=True):
+    if partial_parse:
+        html = LX.slice_regions(html, GR_SHELF_REGIONS)
+    soup = BeautifulSoup(html, 'lxml')
+
+    # Selector for book entries on a shelf page
+    book_entry_sel = ".leftContainer .elementList"
+    book_urls = []
+    for n in soup.select(book_entry_sel):
+        try:
+            book_urls.append(n.find("a", {"class": "bookTitle"})["href"])
+        except Exception as ex:
+            log("Error in getting book URL: "+str(ex)+". Continuing.")
+    return book_urls
 
-        sel_count_rating = "div:nth-child(1) > span:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(2) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(1) > div:nth-child(2) > div:nth-child(1) > span:nth-child(2)"
 
-        for obj in items:
+def extract_gs_data(html):
+    return html2csv.load_plan("gs").extract(html)
+
+
+def get_loc_books_info(html):
+    books = []
+    try:
+        for rec in html2csv.load_plan("loc").extract(html):
             book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
-            try:
-                url_obj = obj.select_one(sel_url)
-                book_info["url"] = url_obj["href"] if url_obj else "--"
-                book_info["title"] = try_get_item(obj, sel_title)
-                book_info["author"] = try_get_item(obj, sel_auth)
+            book_info.update(rec)
+            books.append(book_info)
+            log("Book info: {}".format(book_info))
+    except Exception as ex:
+        log("Error occurred when fetching extracting books: {}".format(ex))
 
-                rt_obj = obj.select_one(sel_rating)
-                book_info["avg_rating"] = rt_obj["aria-label"] if rt_obj else "--"
-                rtc_obj = obj.select_one(sel_count_rating)
-                book_info["ratings"] = rtc_obj["aria-label"] if rtc_obj else "--"
+    return books
 
-                book_info["book_format"] = try_get_item(obj, sel_book_type)
 
-                data.append(book_info)
-            except Exception as ex:
-                traceback.print_exc()
-                log("Error when extracting information from Amazon page. "+str(ex))
-        return data
-
-    def _extract_ndl_data(self, html):
-        soup = BeautifulSoup(html, "lxml")
-        items = soup.select("#browse-result-group > div.list-group-item")
-        print("Records count: {}".format(len(items)))
-        data = []
-        for obj in items:
-            try:
-                title_obj = obj.select_one("div.col-md-11.col-sm-12 > h4 > a")
-                url = title_obj["href"] if title_obj else "--"
-                title = title_obj.text.strip()
-                authors = try_get_item(obj, "div.doc-author.overflow-off")
-                abst = try_get_item(obj, "div.col-sm-7.hidden-xs > font")
-                lang_obj = obj.select_one(
-                    "div > div.col-sm-5 > div.icons > span")
-                lang = lang_obj["title"] if lang_obj else "--"
-
-                data.append({"title": title, "author": authors, "language": lang,
-                             "url": url, "abstract": abst})
-            except Exception as ex:
-                traceback.print_exc()
-                log("Error when extracting information from NDL page. "+str(ex))
-        return data
+def get_amazon_book_info(html):
+    book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
+    try:
+        book_info.update(html2csv.load_plan("amazon_book").extract(html)[0])
+    except Exception as ex:
+        log("Error occurred when fetching Amazon book info: {}".format(ex))
+    log("Book info: {}".format(book_info))
+    return [book_info]
 
-    def extract_from_zip(self, zip_file, src_type):
-        csv_path = os.path.join(self.out_dir, "local_cs.csv")
-        with open(csv_path, "w", newline='') as csvfile:
-            hdr_keys = []
-            if src_type == "AZ" or src_type == "AZB" or src_type == "LOC" :
-                hdr_keys = ROW_KEYS
-            elif src_type == "GS":
-                hdr_keys = GS_ROW_KEYS
-            else:
-                hdr_keys = NDL_ROW_KEYS
-            dw = csv.DictWriter(csvfile, hdr_keys, extrasaction='ignore')
-            dw.writeheader()
-            csvfile.flush()
-            with ZipFile(zip_file) as myzip:
-                recs = 0
-                zitems = [x for x in myzip.namelist()
-                          if x.endswith(".html")
-                          and "__MACOSX" not in x
-                          and "DS_Store" not in x]
-                log("ZIP file {0} contains {1} items.".format(
-                    zip_file, len(zitems)))
-                for zz in zitems:
-                    try:
-                        log("Extracting HTML from ZIP entry: "+str(zz))
-                        with myzip.open(zz) as zf:
-                            html = zf.read()
-                            log("Length of ZIP entry HTML: "+str(len(html)))
-                            if src_type == "NDL":
-                                data = self._extract_ndl_data(html)
-                            elif src_type == "GS":
-                                data = self._extract_gs_data(html)
-                            elif src_type == "AZ":
-                                data = self._extract_amazon_data(html)
-                            elif src_type == "AZB":
-                                data = self._get_amazon_book_info(html)
-                            elif src_type == "LOC":
-                                data = self._get_loc_books_info(html)
-                            else:
-                                raise Exception(
-                                    "Unsupported HTML source: "+str(src_type))
-                            dw.writerows(data)
-                            csvfile.flush()
-                            recs += 1
-                            log("Processed {0}/{1} files.".format(recs,
-                                                                  len(zitems)))
-                    except Exception as ex:
-                        traceback.print_exc()
-                        log("Error when extracting information from page. "+str(ex))
+
+def extract_amazon_data(html):
+    data = []
+    for rec in html2csv.load_plan("amazon_search").extract(html):
+        book_info = dict(zip(ROW_KEYS, ["" for _ in ROW_KEYS]))
+        book_info.update(rec)
+        data.append(book_info)
+    print("Records count: {}".format(len(data)))
+    return data
+
+
+def extract_ndl_data(html):
+    data = html2csv.load_plan("ndl").extract(html)
+    print("Records count: {}".format(len(data)))
+    return data
+
+
+# Extractor of each kind of page, see parse_page
+PAGE_PARSERS = {
+    "NDL": extract_ndl_data,
+    "GS": extract_gs_data,
+    "AZ": extract_amazon_data,
+    "AZB": get_amazon_book_info,
+    "LOC": get_loc_books_info,
+    "GR_SHELF": get_shelf_book_urls,
+    "GR_BOOK": parse_book_detail_lxml,
+    "GR_BOOK_BS4": parse_book_detail,
+}
+
+
+def parse_zip_entry(src_type, partial_parse, entry):
+    """parse_page for an entry given by BookScraper._zip_pages."""
+    return parse_page(src_type, entry[2], partial_parse=partial_parse)
+
+
+def parse_page(kind, html, url=None, partial_parse=True):
+    """Returns what the extractor for `kind` of page (see PAGE_PARSERS)
+    gets from the page. A module function so that pages can be parsed
+    in the worker processes of a ParsePool.
+    """
+    extract = PAGE_PARSERS[kind]
+    if kind.startswith("GR_BOOK"):
+        return extract(html, url, partial_parse)
+    if kind == "GR_SHELF":
+        return extract(html, partial_parse)
+    return extract(html)
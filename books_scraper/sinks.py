@@ -0,0 +1,317 @@
+"""
+Output sinks for the extracted records. Rows are buffered and written in
+batches, once `flush_rows` rows are pending or `flush_sec` seconds have
+passed since the last write, so the number of writes does not grow with
+the number of rows. flush() also makes the rows durable on disk, for
+checkpoints, and close() flushes whatever is left.
+
+A CSV output can also be copied into a Parquet file with typed columns,
+for loading into analytics tools (see csv_to_parquet). This needs the
+optional pyarrow package.
+
+SqliteSink keeps the records of all the runs in one SQLite database,
+one row per record source and key (ISBN, else URL), so that a record
+scraped again replaces its earlier version instead of being repeated.
+"""
+import os
+import re
+import csv
+import json
+import time
+import sqlite3
+import threading
+
+FLUSH_ROWS = 500
+FLUSH_SEC = 5.0
+# Rows per row group of the Parquet files
+PARQUET_ROWS = 50000
+# Types of the numeric columns in the Parquet files, the others are
+# strings. Covers the ROW_KEYS, GS_ROW_KEYS and OUT_CSV_HEADER fields.
+COLUMN_TYPES = {
+    "avg_rating": "float",
+    "ratings": "int",
+    "reviews": "int",
+    "pages": "int",
+    "pub_year": "year",
+    "citedby": "int",
+    "GR ROW": "int",
+    "Lib ROW": "int",
+    "AUTHOR SCORE": "int",
+    "TITLE SCORE": "int",
+    "COMBINED SCORE": "int",
+}
+# What the extractors write for a missing value
+MISSING_VALUES = ("", "--")
+_NUMBER_RE = re.compile(r"\d[\d,]*(?:\.\d+)?")
+_YEAR_RE = re.compile(r"(?<!\d)\d{4}(?!\d)")
+# Columns of the records table read from the record fields, with their
+# COLUMN_TYPES kind. The whole record is kept as JSON in the data column.
+RECORD_COLUMNS = [("author", None), ("title", None), ("genre", None),
+                  ("isbn", None), ("url", None), ("pub_year", "year"),
+                  ("avg_rating", "float"), ("ratings", "int")]
+RECORDS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    source TEXT NOT NULL,
+    key TEXT NOT NULL,
+    author TEXT,
+    title TEXT,
+    genre TEXT,
+    isbn TEXT,
+    url TEXT,
+    pub_year INTEGER,
+    avg_rating REAL,
+    ratings INTEGER,
+    data TEXT NOT NULL,
+    run TEXT,
+    first_seen REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (source, key));
+CREATE INDEX IF NOT EXISTS records_author ON records(author);
+CREATE INDEX IF NOT EXISTS records_title ON records(title);
+CREATE INDEX IF NOT EXISTS records_genre ON records(genre);
+CREATE INDEX IF NOT EXISTS records_pub_year ON records(pub_year);
+CREATE INDEX IF NOT EXISTS records_isbn ON records(isbn);
+"""
+
+
+class CsvSink(object):
+    """Buffered csv.DictWriter writing to `path`, appended to when
+    `append` is set. Can be shared by several threads.
+    """
+
+    def __init__(self, path, fieldnames, append=False, flush_rows=FLUSH_ROWS,
+                 flush_sec=FLUSH_SEC, extrasaction="ignore"):
+        self.path = path
+        self.fp = open(path, "a" if append else "w", newline='')
+        self.writer = csv.DictWriter(self.fp, fieldnames,
+                                     extrasaction=extrasaction)
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self.rows = []
+        self.last_write = time.monotonic()
+        self.lock = threading.Lock()
+
+    def writeheader(self):
+        with self.lock:
+            self.writer.writeheader()
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        with self.lock:
+            self.rows.extend(rows)
+            if len(self.rows) >= self.flush_rows or \
+                    time.monotonic() - self.last_write >= self.flush_sec:
+                self._write()
+
+    def _write(self):
+        self.writer.writerows(self.rows)
+        self.rows = []
+        self.fp.flush()
+        self.last_write = time.monotonic()
+
+    def flush(self):
+        """Writes the pending rows and syncs the file to disk. Returns
+        the size of the file.
+        """
+        with self.lock:
+            self._write()
+            os.fsync(self.fp.fileno())
+            return self.fp.tell()
+
+    def close(self):
+        if not self.fp.closed:
+            self.flush()
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteSink(object):
+    """Upserts records into the records table of the SQLite database at
+    `db_path`, under `source` (e.g. GOODREADS or the ZIP source type) and
+    the run label `run`. Rows are buffered like in CsvSink and each batch
+    is written in one transaction. Can be shared by several threads.
+    """
+
+    def __init__(self, db_path, source, run=None, flush_rows=FLUSH_ROWS,
+                 flush_sec=FLUSH_SEC):
+        self.path = db_path
+        self.source = source
+        self.run = run
+        # Other jobs may write to the same database, hence the WAL
+        # journal and the generous lock timeout.
+        self.conn = sqlite3.connect(db_path, timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(RECORDS_SCHEMA)
+        cols = ["source", "key"] + [c for c, _ in RECORD_COLUMNS] + \
+            ["data", "run", "first_seen", "updated_at"]
+        updates = [c for c in cols if c not in ("source", "key", "first_seen")]
+        self.upsert = "INSERT INTO records({0}) VALUES ({1}) " \
+            "ON CONFLICT(source, key) DO UPDATE SET {2}".format(
+                ", ".join(cols), ", ".join("?" for _ in cols),
+                ", ".join("{0}=excluded.{0}".format(c) for c in updates))
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self.rows = []
+        self.last_write = time.monotonic()
+        self.lock = threading.Lock()
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        with self.lock:
+            self.rows.extend(rows)
+            if len(self.rows) >= self.flush_rows or \
+                    time.monotonic() - self.last_write >= self.flush_sec:
+                self._write()
+
+    def _values(self, row, now):
+        key = record_key(row)
+        if key is None:
+            return None
+        return [self.source, key] + \
+            [typed_value(row.get(c), k) for c, k in RECORD_COLUMNS] + \
+            [json.dumps(row), self.run, now, now]
+
+    def _write(self):
+        now = time.time()
+        vals = [v for v in (self._values(r, now) for r in self.rows) if v]
+        if vals:
+            with self.conn:
+                self.conn.executemany(self.upsert, vals)
+        self.rows = []
+        self.last_write = time.monotonic()
+
+    def flush(self):
+        """Writes the pending rows. Returns the number of records of
+        the source.
+        """
+        with self.lock:
+            self._write()
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM records WHERE source=?",
+                (self.source,)).fetchone()[0]
+
+    def close(self):
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TeeSink(object):
+    """Writes the rows to each of `sinks`, e.g. a CsvSink and a
+    SqliteSink. flush() returns what the first sink's flush() returns.
+    """
+
+    def __init__(self, *sinks):
+        self.sinks = [s for s in sinks if s is not None]
+
+    def writeheader(self):
+        for s in self.sinks:
+            s.writeheader()
+
+    def writerow(self, row):
+        self.writerows([row])
+
+    def writerows(self, rows):
+        for s in self.sinks:
+            s.writerows(rows)
+
+    def flush(self):
+        return [s.flush() for s in self.sinks][0]
+
+    def close(self):
+        for s in self.sinks:
+            s.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def record_key(row):
+    """Key of a record in the records table: its ISBN, else its URL,
+    else its author and title (some sources have neither), or None when
+    it has no title either.
+    """
+    for name in ("isbn", "url"):
+        val = typed_value(row.get(name))
+        if val:
+            return name+":"+val
+    title = typed_value(row.get("title"))
+    if title:
+        return "title:{0}|{1}".format(typed_value(row.get("author")) or "",
+                                      title)
+    return None
+
+
+def typed_value(val, kind=None):
+    """Value of a CSV field as a column of `kind` (see COLUMN_TYPES), or
+    None when it is missing or not a number, e.g. "1,234 ratings" -> 1234
+    and "May 5th 2004" -> 2004 as a year.
+    """
+    val = (val or "").strip()
+    if val in MISSING_VALUES:
+        return None
+    if not kind:
+        return val
+    m = (_YEAR_RE if kind == "year" else _NUMBER_RE).search(val)
+    if not m:
+        return None
+    num = float(m.group(0).replace(",", ""))
+    return num if kind == "float" else int(num)
+
+
+def csv_to_parquet(csv_path, parquet_path=None, batch_rows=PARQUET_ROWS):
+    """Copies a CSV output file into a Parquet file, by default next to
+    it with the .parquet extension. Numeric columns are typed and missing
+    values are nulls. The rows are read and written batch_rows at a time,
+    one row group each, so the data is never held in memory whole.
+    Returns the Parquet file path.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Parquet output needs pyarrow (pip install pyarrow).")
+
+    arrow_types = {"float": pa.float64(), "int": pa.int64(),
+                   "year": pa.int32()}
+    parquet_path = parquet_path or os.path.splitext(csv_path)[0]+".parquet"
+    with open(csv_path, newline='') as fp:
+        reader = csv.DictReader(fp)
+        names = reader.fieldnames or []
+        kinds = [COLUMN_TYPES.get(n) for n in names]
+        schema = pa.schema([(n, arrow_types.get(k, pa.string()))
+                            for n, k in zip(names, kinds)])
+        with pq.ParquetWriter(parquet_path, schema) as writer:
+            cols = [[] for _ in names]
+            for row in reader:
+                for col, n, k in zip(cols, names, kinds):
+                    col.append(typed_value(row.get(n), k))
+                if len(cols[0]) >= batch_rows:
+                    writer.write_table(pa.table(cols, schema=schema))
+                    cols = [[] for _ in names]
+            if not names or cols[0]:
+                writer.write_table(pa.table(cols, schema=schema))
+    return parquet_path
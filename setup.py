@@ -13,6 +13,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/bsodhi/books_scraper",
     packages=setuptools.find_packages(),
+    package_data={"books_scraper": ["selectors/*.sel"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -25,9 +26,9 @@ setuptools.setup(
                       "lxml",
                       "argparse",
                       "beautifulsoup4",
-                      "fake_useragent",
                       "scholarly",
                       "selenium", ],
+    extras_require={"parquet": ["pyarrow"]},
     entry_points={
         'console_scripts': [
             'bscrape=books_scraper.scraper:main',
@@ -1,4 +1,6 @@
 import textdistance as TD
+import os
+import sys
 import re
 import csv
 import argparse
@@ -9,6 +11,9 @@ from concurrent.futures import as_completed
 import queue
 import threading
 import logging
+# Allows importing from: ../../
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from books_scraper.sinks import CsvSink, csv_to_parquet
 
 OUT_CSV_HEADER = ['GR ROW', 'GR AUTHOR', 'GR TITLE',
                   'Lib ROW', 'Lib AUTHOR', 'Lib TITLE',
@@ -91,16 +96,18 @@ def get_csv_data(file_path):
 
 
 def find_fuzz(gr_csv_file, lib_csv_file, score, match_mode,
-        out_file='results.csv', log_file="fuzzy_task.log"):
+        out_file='results.csv', log_file="fuzzy_task.log",
+        parquet_output=False):
+    sink = None
     try:
         global LOG_FILE
         LOG_FILE = log_file
         log("Starting new job.", clear=True)
         ref_len = file_len(gr_csv_file)
         log("Total rows in GR CSV={0}".format(ref_len))
-        with open(out_file, 'w', newline='') as outcsv:
-            writer = csv.DictWriter(outcsv, fieldnames=OUT_CSV_HEADER)
-            writer.writeheader()
+        # Shared by the workers, matches are written in batches
+        sink = CsvSink(out_file, OUT_CSV_HEADER, extrasaction="raise")
+        sink.writeheader()
 
         q = queue.Queue(maxsize=100)
         threads = []
@@ -125,7 +132,7 @@ def find_fuzz(gr_csv_file, lib_csv_file, score, match_mode,
                 "lib_rows": lib_rows, "score": score,
                 "match_mode": match_mode, "counter": ctr,
                 "total_rows": len(gr_rows), 
-                "out_file":out_file})
+                "sink": sink})
 
         # block until all tasks are done
         q.join()
@@ -136,10 +143,15 @@ def find_fuzz(gr_csv_file, lib_csv_file, score, match_mode,
         for t in threads:
             t.join()
         
-        
         log("Stopped all worker threads.")
+        sink.close()
+        if parquet_output:
+            log("Saved "+csv_to_parquet(out_file))
     except Exception as ex:
         log("Error occurred: "+str(ex))
+    finally:
+        if sink:
+            sink.close()
 
 
 def worker(task_queue):
@@ -149,10 +161,7 @@ def worker(task_queue):
             if item is None:
                 break
             matches = check_match(item)
-            out_file = item.get("out_file")
-            with open(out_file, 'a', newline='') as outcsv:
-                writer = csv.DictWriter(outcsv, fieldnames=OUT_CSV_HEADER)
-                writer.writerows(matches)
+            item.get("sink").writerows(matches)
             ctr = item.get("counter")
             ctr.val += len(matches)
             task_queue.task_done()
@@ -187,9 +196,12 @@ if __name__ == "__main__":
                     TA: Title plus author,
                     TTA: Title or (title+author).
                     """)
+    ap.add_argument("-p", "--parquet", action="store_true", dest="parquet",
+                    help="Also write the results as a Parquet file.")
     args = ap.parse_args()
     start_time = time.time()
-    find_fuzz(args.goodreads_csv, args.library_csv, args.score, args.columns)
+    find_fuzz(args.goodreads_csv, args.library_csv, args.score, args.columns,
+              parquet_output=args.parquet)
     time_taken = time.strftime(
         "%H:%M:%S", time.gmtime(time.time() - start_time))
     log("Done in "+time_taken)
@@ -37,6 +37,8 @@ HTML_DIR = "{0}/html/".format(os.getcwd())
 Path(HTML_DIR).mkdir(parents=True, exist_ok=True)
 logging.basicConfig(filename='scraper.log', level=logging.INFO)
 Path(UPLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
+# Records of all the tasks of a user, kept in the user's folder
+RECORDS_DB = "records.db"
 
 TPE = concurrent.futures.ThreadPoolExecutor(max_workers=5)
 
@@ -101,12 +103,78 @@ def _add_user(login_id, pass_hashed, full_name, role="USER"):
         conn.commit()
 
 
+def _records_db(login_id):
+    """Path of the user's records database, shared by all the tasks, or
+    None when it is turned off.
+    """
+    if not CONFIG.get("records_db", True):
+        return None
+    return os.path.join(os.getcwd(), login_id, RECORDS_DB)
+
+
+def _process_start(pid):
+    """Start time of process `pid` in clock ticks since boot, where /proc
+    tells it, else None. With the pid it tells the process which wrote a
+    pid file from a later one given the same pid.
+    """
+    try:
+        with open("/proc/{0}/stat".format(pid)) as fp:
+            return fp.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+PROCESS_START = _process_start(os.getpid())
+
+
+def _pid_info(desc):
+    return json.dumps({"pid": os.getpid(), "started": PROCESS_START,
+                       "task": desc})
+
+
+def _read_pid_file(pid_file):
+    """The contents of a pid file as written by _pid_info, or None. A
+    file of an older version only holds the task description.
+    """
+    try:
+        with open(pid_file) as pf:
+            text = pf.read()
+    except OSError:
+        return None
+    try:
+        info = json.loads(text)
+    except ValueError:
+        info = None
+    return info if isinstance(info, dict) else {"task": text}
+
+
+def _task_running(task_dir):
+    """True if the task of `task_dir` is still running. Its pid file is
+    stale when the process which wrote it is gone, e.g. after a crash or
+    a restart of the server.
+    """
+    info = _read_pid_file(os.path.join(task_dir, "pid"))
+    if not info:
+        return False
+    pid = info.get("pid")
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    started = _process_start(pid)
+    return not (started and info.get("started") and
+                started != info["started"])
+
+
 def _scrape_goodreads(query, max_rec, out_dir, dont_ucb, login_id):
     pid_file = os.path.join(out_dir, "pid")
-    SCR.LOG_FILE = os.path.join(out_dir, "task.log")
     try:
         with open(pid_file, "w") as pif:
-            pif.write(query)
+            pif.write(_pid_info(query))
 
         bs = SCR.BookScraper(query,
                              max_recs=max_rec,
@@ -117,7 +185,28 @@ def _scrape_goodreads(query, max_rec, out_dir, dont_ucb, login_id):
                              gr_password=CONFIG["gr_password"],
                              web_browser=CONFIG["browser"],
                              timeout=CONFIG["timeout"],
-                             http_delay_sec=CONFIG["http_delay_sec"])
+                             http_delay_sec=CONFIG["http_delay_sec"],
+                             fetch_workers=CONFIG.get("fetch_workers", 1),
+                             req_per_sec=CONFIG.get("req_per_sec"),
+                             max_req_per_sec=CONFIG.get("max_req_per_sec"),
+                             http_pool_size=CONFIG.get("http_pool_size"),
+                             max_retries=CONFIG.get("max_retries", 3),
+                             breaker_failures=CONFIG.get("breaker_failures", 5),
+                             breaker_reset_sec=CONFIG.get("breaker_reset_sec", 60),
+                             ua_file=CONFIG.get("ua_file"),
+                             cache_max_mb=CONFIG.get("cache_max_mb"),
+                             cache_ttl_days=CONFIG.get("cache_ttl_days"),
+                             parser_engine=CONFIG.get("parser_engine", "lxml"),
+                             partial_parse=CONFIG.get("partial_parse", True),
+                             parse_workers=CONFIG.get("parse_workers", 1),
+                             parquet_output=CONFIG.get("parquet_output", False),
+                             records_db=_records_db(login_id),
+                             driver_pool_size=CONFIG.get("driver_pool_size", 1),
+                             http_shelves=CONFIG.get("http_shelves", False),
+                             lean_browser=CONFIG.get("lean_browser", False),
+                             pages_per_sec=CONFIG.get("pages_per_sec"),
+                             pacing_jitter=CONFIG.get("pacing_jitter", 0.5),
+                             log_file=os.path.join(out_dir, "task.log"))
         bs.scrape_goodreads_books()
 
     except Exception as ex:
@@ -132,6 +221,7 @@ def _scrape_goodreads(query, max_rec, out_dir, dont_ucb, login_id):
             logging.info("Closed pending task for user "+login_id)
         except Exception as ex2:
             logging.exception("Failed to close the task.")
+        SCR.set_log_file(None)
 
 
 def _fmt_date_str(dt_str):
@@ -148,8 +238,8 @@ def _existing_tasks(login_id):
     pid_files = glob.glob("{0}/**/pid".format(base_path))
     pids = []
     for pfile in pid_files:
-        with open(pfile, "r") as pf:
-            pids.append(pf.read())
+        if _task_running(os.path.dirname(pfile)):
+            pids.append(_read_pid_file(pfile).get("task", ""))
     return pids
 
 
@@ -169,6 +259,14 @@ def start():
     return redirect(url_for('bp.task_status'))
 
 
+def _task_progress(task_dir):
+    """Progress of the ZIP extraction running in task_dir, or None."""
+    ckpt = SCR.read_zip_checkpoint(task_dir)
+    if ckpt and ckpt.get("total"):
+        return "{0}/{1} files".format(ckpt["entries"], ckpt["total"])
+    return None
+
+
 @auth_check
 def task_status():
     path = "{0}/{1}".format(os.getcwd(), session['login_id'])
@@ -179,7 +277,8 @@ def task_status():
             {"folder": d.split("/")[-1],
              "folder_label": _fmt_date_str(d.split("/")[-1]),
              "files": [f.path for f in os.scandir(d) if f.is_file()],
-             "status": "RUNNING" if glob.glob(d+"/pid") else "FINISHED",
+             "status": "RUNNING" if _task_running(d) else "FINISHED",
+             "progress": _task_progress(d),
              } for d in subfolders]
     else:
         data = []
@@ -280,13 +379,85 @@ def logout():
     return redirect(url_for('bp.index'))
 
 
+def _claim_task_dir(out_dir, desc):
+    """Creates the pid file of `out_dir`, failing if the task of an
+    existing one is still running, so that at most one task runs in a
+    directory. A stale pid file is replaced. Returns True if claimed.
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    pid_file = os.path.join(out_dir, "pid")
+    for _ in range(2):
+        try:
+            fd = os.open(pid_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            if _task_running(out_dir):
+                return False
+            logging.info("Removing the stale pid file in: "+out_dir)
+            try:
+                os.remove(pid_file)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as pif:
+            pif.write(_pid_info(desc))
+        return True
+    return False
+
+
+def _zip_out_dir(file_path, login_id, src_type, desc):
+    """Returns the output directory of an interrupted extraction of the
+    same ZIP content, claimed for this task, or None. Directories whose
+    task is still running are not resumed.
+    """
+    ckpt_files = glob.glob("{0}/{1}/*/{2}".format(
+        os.getcwd(), login_id, SCR.ZIP_CHECKPOINT))
+    if not ckpt_files:
+        return None
+    zip_digest = SCR.file_digest(file_path)
+    for ckpt_file in sorted(ckpt_files, reverse=True):
+        out_dir = os.path.dirname(ckpt_file)
+        if _task_running(out_dir):
+            continue
+        ckpt = SCR.read_zip_checkpoint(out_dir)
+        if ckpt and ckpt["zip"] == zip_digest and \
+                ckpt["src_type"] == src_type and \
+                _claim_task_dir(out_dir, desc):
+            return out_dir
+    return None
+
+
 def _process_zip_upload(file_path, login_id, src_type):
     logging.info("Processing: "+file_path)
-    out_dir = "{0}/{1}/{2}".format(os.getcwd(), login_id, get_ts_str())
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
-    bs = SCR.BookScraper("", html_dir=HTML_DIR, out_dir=out_dir,
-                         http_delay_sec=CONFIG["http_delay_sec"])
-    bs.extract_from_zip(file_path, src_type)
+    desc = "{0} ({1})".format(os.path.basename(file_path), src_type)
+    out_dir = _zip_out_dir(file_path, login_id, src_type, desc)
+    if out_dir:
+        logging.info("Resuming the extraction in: "+out_dir)
+    else:
+        out_dir = "{0}/{1}/{2}".format(os.getcwd(), login_id, get_ts_str())
+        # Another task may have started in the same second
+        while not _claim_task_dir(out_dir, desc):
+            out_dir = "{0}/{1}/{2}_{3}".format(
+                os.getcwd(), login_id, get_ts_str(), random_str(4))
+    pid_file = os.path.join(out_dir, "pid")
+    try:
+        bs = SCR.BookScraper("", html_dir=HTML_DIR, out_dir=out_dir,
+                             http_delay_sec=CONFIG["http_delay_sec"],
+                             parse_workers=CONFIG.get("parse_workers", 1),
+                             parquet_output=CONFIG.get("parquet_output", False),
+                             records_db=_records_db(login_id),
+                             log_file=os.path.join(out_dir, "task.log"))
+        bs.extract_from_zip(file_path, src_type)
+
+    except Exception as ex:
+        logging.exception("Error occurred when processing ZIP file.")
+    finally:
+        try:
+            if os.path.exists(pid_file):
+                os.remove(pid_file)
+            logging.info("Closed pending task for user "+login_id)
+        except Exception as ex2:
+            logging.exception("Failed to close the task.")
+        SCR.set_log_file(None)
 
 
 @auth_check
@@ -309,11 +480,14 @@ def upload_file():
                                        error="No file data found!",
                                        name=escape(login_id))
             if file and file.filename.endswith(".zip"):
-                sfn = secure_filename(file.filename)
+                # Unique name, a running job may still read an earlier
+                # upload of the same file.
+                sfn = "{0}_{1}".format(get_ts_str(),
+                                       secure_filename(file.filename))
                 file_path = os.path.join(UPLOAD_FOLDER, sfn)
                 file.save(file_path)
                 src_type = request.form.get("src_type")
-                _process_zip_upload(file_path, login_id, src_type)
+                TPE.submit(_process_zip_upload, file_path, login_id, src_type)
                 return redirect(url_for('bp.task_status'))
             else:
                 logging.error("File type not allowed!")
@@ -349,7 +523,8 @@ def _process_fuzzy_match(login_id, fp_gr, fp_lib, score, match_mode):
         log_file = os.path.join(os.getcwd(), login_id,
                                 "fuzzy_task.log")
         find_fuzz(fp_gr, fp_lib, score, match_mode,
-                  out_file=out_file, log_file=log_file)
+                  out_file=out_file, log_file=log_file,
+                  parquet_output=CONFIG.get("parquet_output", False))
         logging.info("Fuzzy check complete.")
     except Exception as ex:
         logging.exception("Error occurred.")